@@ -1,11 +1,23 @@
-import logging, sys, json, os
-from fastapi import FastAPI , HTTPException, Request
+import logging, sys, json, os, hashlib, asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI , APIRouter, HTTPException, Request, Query
+from fastapi.responses import Response, StreamingResponse, PlainTextResponse
 import uvicorn
 
 # Custom Libraries
 from libs.MessageHandler import RequestHandler, ResponseHandler
 from libs.AuthHandler import AuthHandler
-from libs.DBHandler import DBHandler
+from libs.DBHandler import DBHandler, normalize_job_time
+from libs.AsyncDBHandler import AsyncDBHandler
+from libs.AsyncAuthHandler import AsyncAuthHandler
+from libs.ChangeFeed import ChangeNotifier
+from libs.RetentionSweeper import RetentionSweeper
+from libs.JobLoader import load_jobs, read_jobs_ndjson
+from libs.ConnectionPool import close_all_pools, get_pool_stats, get_statement_cache_stats
+from libs.CacheHandler import get_cache, get_cache_stats
+from libs.CustomExceptions import InvalidInputError
+from libs.MetricsHandler import REGISTRY, Gauge, MetricsMiddleware
+from libs.LogHandler import configure_logging, get_dropped_log_records, LogContextMiddleware
 
 
 def get_config(path_to_config:str) -> json:
@@ -13,36 +25,99 @@ def get_config(path_to_config:str) -> json:
         with open(path_to_config) as app_cfg_f:
             return json.load(app_cfg_f)
     else:
-        logging.error(f"Unable to find config file at '{path_to_config}'. App Exiting..")
+        logging.error("Unable to find config file at '%s'. App Exiting..", path_to_config)
         sys.exit()
 
 
-# Init instance of FastAPI() to attach endpoints to
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app:FastAPI):
+    # Startup - all database work from the endpoints goes through this bounded executor
+    app.state.db = AsyncDBHandler(os.environ["DB_URL"],
+                                  max_workers=int(os.environ["DB_MAX_WORKERS"]),
+                                  max_pending=int(os.environ["DB_MAX_PENDING"]))
+    # Password hashing runs in its own process pool, see AsyncAuthHandler
+    app.state.auth = AsyncAuthHandler(max_workers=int(os.environ["PASSWORD_HASH_WORKERS"]),
+                                      max_pending=int(os.environ["PASSWORD_HASH_MAX_PENDING"]),
+                                      n=int(os.environ["PASSWORD_SCRYPT_N"]),
+                                      r=int(os.environ["PASSWORD_SCRYPT_R"]),
+                                      p=int(os.environ["PASSWORD_SCRYPT_P"]))
+    app.state.change_notifier = ChangeNotifier(app.state.db, poll_interval=float(os.environ["CHANGE_FEED_POLL_SECONDS"]))
+    app.state.change_notifier.start()
+    app.state.retention_sweeper = RetentionSweeper(app.state.db,
+                                                   interval_seconds=float(os.environ["RETENTION_SWEEP_INTERVAL_SECONDS"]),
+                                                   batch_size=int(os.environ["RETENTION_SWEEP_BATCH_SIZE"]),
+                                                   job_changes_retention_seconds=float(os.environ["JOB_CHANGES_RETENTION_DAYS"]) * 86400)
+    app.state.retention_sweeper.start()
+    yield
+    # Shutdown - finish in-flight queries, then close the pooled database connections so file handles are released cleanly
+    await app.state.retention_sweeper.stop()
+    await app.state.change_notifier.stop()
+    app.state.db.shutdown()
+    app.state.auth.shutdown()
+    logging.info("Shutting down. Connection pool stats: %s Statement cache stats: %s Cache stats: %s",
+                 get_pool_stats(), get_statement_cache_stats(), get_cache_stats())
+    close_all_pools()
+
+
+# Endpoints are attached to a router, create_app() builds the FastAPI() instance around it
+router = APIRouter()
+
+# Pool and cache stats are read when /metrics is scraped
+REGISTRY.register(Gauge("api_db_pool_connections", "Pooled database connections by state", ("db", "state"),
+                        lambda: {(db_path, state.lower()): value for db_path, stats in get_pool_stats().items()
+                                 for state, value in stats.items()}))
+REGISTRY.register(Gauge("api_cache_entries", "In-process cache counters (size, hits, misses, evictions)", ("cache", "stat"),
+                        lambda: {(cache_name, stat.lower()): value for cache_name, stats in get_cache_stats().items()
+                                 for stat, value in stats.items()}))
+REGISTRY.register(Gauge("api_db_statement_cache", "Prepared statement reuse across pooled connections (size, cached, hits, misses, hit_rate)",
+                        ("db", "stat"),
+                        lambda: {(db_path, stat.lower()): value for db_path, stats in get_statement_cache_stats().items()
+                                 for stat, value in stats.items()}))
+REGISTRY.register(Gauge("api_log_records_dropped", "Log records dropped because the log queue was full", (),
+                        lambda: {(): get_dropped_log_records()}))
 
 ### ENDPOINTS
-@app.get("/")
+@router.get("/")
 def base_url():
     return {"Welcome to the API. Please get a token at /login"}
 
 
-@app.post("/login")
+@router.get("/metrics")
+def get_metrics():
+    # Prometheus text exposition format. Unauthenticated, like most scrape targets - keep it off public interfaces
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+@router.post("/login")
 async def verify_login(logon_request:Request) -> dict:
     response = {"STATUS": "FAILED", "MESSAGE": "Login failed"}
     additonal_info = ""
-    body = await logon_request.json()
-    logging.info(f"Received a logon request '{body}'")
+    try:
+        body = await logon_request.json()
+    except ValueError:
+        # JSONDecodeError and UnicodeDecodeError are both ValueErrors. Rejected as not a valid logon_request below
+        body = None
+    # Never log the body, it holds the password
+    logging.info("Received a logon request for '%s'", body.get("username") if isinstance(body, dict) else None)
     if RequestHandler().verify_login_request(body):
-        user_details = DBHandler(os.environ["DB_URL"]).retrieve_user_details(body["username"])
-        if user_details["STATUS"] and user_details["ROWS"][0][3] == body["password"]:
+        db = logon_request.app.state.db
+        auth = logon_request.app.state.auth
+        user_details = await db.run(DBHandler.retrieve_user_details, body["username"])
+        password_hash = user_details["ROWS"][0][3] if user_details["STATUS"] else None
+        password_valid = await auth.verify_password(body["password"], password_hash)
+        if user_details["STATUS"] and password_valid:
+            if auth.needs_rehash(password_hash):
+                # Work factors were raised since this password was hashed, upgrade it while the plaintext is at hand
+                await db.run(DBHandler.update_user_password, user_details["ROWS"][0][0], body["username"],
+                             await auth.hash_password(body["password"]))
             user_session_token = AuthHandler().get_token(32)
-            logging.info(f"Token Granted to {body['username']}: '{user_session_token}'")
-            register_token_result = DBHandler(os.environ["DB_URL"]).register_new_token(user_session_token, user_details["ROWS"][0][0])
+            logging.info("Token Granted to %s", body["username"])
+            register_token_result = await db.run(DBHandler.register_new_token, user_session_token, user_details["ROWS"][0][0])
             if register_token_result["STATUS"]:
                 logging.info("Token successfully recorded in database")
                 response = {"STATUS": "SUCCESS", "TOKEN" : user_session_token, "MESSAGE": "Login Successful"}
             else:
-                logging.error("Failed to register token. Received '{body}' Token: '{user_session_token}'")
+                logging.error("Failed to register token for %s", body["username"])
         else:
             additonal_info = "Password did not match and/or not a valid user"
             logging.warning(additonal_info)
@@ -53,54 +128,327 @@ async def verify_login(logon_request:Request) -> dict:
     response["MESSAGE"] = response["MESSAGE"] if additonal_info == "" else f"{response['MESSAGE']} - {additonal_info}" 
     return response
 
-@app.get("/jobs")
-async def get_list_of_jobs(get_jobs_request:Request):
+def etag_matches(http_request:Request, etag:str) -> bool:
+    if_none_match = http_request.headers.get("if-none-match")
+    if if_none_match is None:
+        return False
+    # Weak comparison (RFC 9110) - W/ prefixes are ignored and "*" matches anything
+    client_etags = [client_etag.strip().removeprefix("W/") for client_etag in if_none_match.split(",")]
+    return "*" in client_etags or etag in client_etags
+
+
+async def check_request_token(db:AsyncDBHandler, token_str:str) -> tuple[bool, str, int]:
+    # The request's one data_version read. It syncs tokens revoked by any worker into the token cache before the cache
+    # is consulted, and the /jobs endpoints key their response cache on it
+    data_version = await db.data_version()
+    token_valid, token_check_message = await db.check_token(token_str)
+    return token_valid, token_check_message, data_version
+
+
+async def cached_jobs_response(http_request:Request, data_version:int, cache_key:str, load_body) -> Response:
+    # Serves the encoded body from the response cache for as long as the database has not been committed to.
+    # data_version is read *before* the query (see check_request_token()) so a write landing mid-query only causes
+    # an extra reload, never a stale hit
+    response_cache = get_cache("responses", max_size=int(os.environ["RESPONSE_CACHE_SIZE"]), ttl_seconds=None)
+    cached_entry = response_cache.get(cache_key)
+    if cached_entry is not None and cached_entry[0] == data_version:
+        _, etag, body = cached_entry
+    else:
+        body = await load_body()
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        response_cache.set(cache_key, (data_version, etag, body))
+    if etag_matches(http_request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(body, media_type="application/json", headers={"ETag": etag})
+
+
+async def stream_jobs(db:AsyncDBHandler, after_job_id:int, chunk_size:int, job_filters:dict):
+    # Reads the table one keyset chunk at a time and sends each chunk as soon as it is read,
+    # so memory stays at one chunk and no connection/read lock is held while a slow client drains the stream
+    while True:
+        jobs_page_result = await db.run(DBHandler.get_jobs_page, after_job_id, chunk_size, **job_filters)
+        job_list = jobs_page_result["ROWS"]
+        if len(job_list) <= 1:
+            break
+        yield ResponseHandler().generate_jobs_ndjson(job_list)
+        if len(job_list) - 1 < chunk_size:
+            break
+        after_job_id = job_list[-1][job_list[0].index("job_id")]
+
+
+@router.get("/jobs")
+async def get_list_of_jobs(get_jobs_request:Request, after_job_id:int|None=None, limit:int|None=None, format:str="json",
+                           running:bool|None=None, program:str|None=None, started_after:str|None=None, started_before:str|None=None):
     http_request = get_jobs_request
     token_success, token_msg = RequestHandler().check_token_is_present(http_request)
     if token_success:
-        dbh = DBHandler(os.environ["DB_URL"])
-        token_valid, token_check_message = dbh.check_token_is_valid(token_msg)
+        db = http_request.app.state.db
+        token_valid, token_check_message, data_version = await check_request_token(db, token_msg)
+        if token_valid:
+            try:
+                job_filters = {"running": running, "program": program,
+                               "started_after": normalize_job_time(started_after), "started_before": normalize_job_time(started_before)}
+            except InvalidInputError as err:
+                return {"STATUS": "FAILED", "MESSAGE": f"Not a valid jobs filter. Reason: '{err}'"}
+            job_filters = {filter_name: value for filter_name, value in job_filters.items() if value is not None}
+            filters_key = json.dumps(job_filters, sort_keys=True)
+            page_size = min(max(limit or int(os.environ["JOBS_PAGE_SIZE"]), 1), int(os.environ["JOBS_MAX_PAGE_SIZE"]))
+            if format == "ndjson":
+                return StreamingResponse(stream_jobs(db, after_job_id or 0, page_size, job_filters), media_type="application/x-ndjson")
+            elif after_job_id is not None or limit is not None:
+                async def load_jobs_page() -> bytes:
+                    jobs_page_result = await db.run(DBHandler.get_jobs_page, after_job_id or 0, page_size, **job_filters)
+                    return ResponseHandler().encode_jobs_page_response(jobs_page_result['ROWS'], page_size)
+                return await cached_jobs_response(http_request, data_version, f"jobs:{after_job_id or 0}:{page_size}:{filters_key}", load_jobs_page)
+            elif job_filters:
+                async def load_filtered_jobs() -> bytes:
+                    filtered_jobs_query_result = await db.run(DBHandler.get_filtered_jobs, **job_filters)
+                    return ResponseHandler().encode_jobs_response(filtered_jobs_query_result['ROWS'])
+                return await cached_jobs_response(http_request, data_version, f"jobs:{filters_key}", load_filtered_jobs)
+
+            async def load_all_jobs() -> bytes:
+                all_jobs_query_result = await db.run(DBHandler.get_all_jobs)
+                return ResponseHandler().encode_jobs_response(all_jobs_query_result['ROWS'])
+            return await cached_jobs_response(http_request, data_version, "jobs", load_all_jobs)
+        else:
+            return {"STATUS": "FAILED", "MESSAGE": f"Token is Invalid. Reason: '{token_check_message}'"}
+    else:
+        logging.warning("/jobs/all request failed. No token present. Reason: '%s'", token_msg)
+        return {"STATUS": "FAILED", "MESSAGE": f"Unable to retrieve token from Headers. Reason: '{token_msg}'"}
+
+
+@router.post("/jobs/lookup")
+async def lookup_jobs(http_request:Request):
+    token_success, token_msg = RequestHandler().check_token_is_present(http_request)
+    if token_success:
+        db = http_request.app.state.db
+        token_valid, token_check_message, _ = await check_request_token(db, token_msg)
+        if token_valid:
+            try:
+                body = await http_request.json()
+            except ValueError as err:
+                # JSONDecodeError and UnicodeDecodeError are both ValueErrors
+                return {"STATUS": "FAILED", "MESSAGE": f"Not a valid jobs lookup request. Reason: 'Body is not valid JSON. {err}'"}
+            request_valid, request_message = RequestHandler().verify_jobs_lookup_request(body, int(os.environ["JOBS_LOOKUP_MAX_IDS"]))
+            if request_valid:
+                jobs_query_result = await db.run(DBHandler.get_jobs_by_ids, body["job_ids"])
+                return Response(ResponseHandler().encode_jobs_lookup_response(jobs_query_result['ROWS'], body["job_ids"]),
+                                media_type="application/json")
+            else:
+                logging.info("Not a valid jobs lookup request. Reason: '%s'", request_message)
+                return {"STATUS": "FAILED", "MESSAGE": f"Not a valid jobs lookup request. Reason: '{request_message}'"}
+        else:
+            return {"STATUS": "FAILED", "MESSAGE": f"Token is Invalid. Reason: '{token_check_message}'"}
+    else:
+        logging.warning("/jobs/lookup request failed. No token present. Reason: '%s'", token_msg)
+        return {"STATUS": "FAILED", "MESSAGE": f"Unable to retrieve token from Headers. Reason: '{token_msg}'"}
+
+
+@router.post("/jobs/ingest")
+async def ingest_jobs(http_request:Request):
+    # Body is NDJSON, one job per line. Jobs are upserted on program in batches of JOBS_INGEST_BATCH_SIZE,
+    # bad lines are reported back by line number and don't stop the rest of the load
+    token_success, token_msg = RequestHandler().check_token_is_present(http_request)
+    if token_success:
+        db = http_request.app.state.db
+        token_valid, token_check_message, _ = await check_request_token(db, token_msg)
         if token_valid:
-            all_jobs_query_result = dbh.get_all_jobs()
-            return ResponseHandler().generate_jobs_response(all_jobs_query_result['ROWS'])
+            try:
+                lines = (await http_request.body()).decode("utf-8").splitlines()
+            except UnicodeDecodeError as err:
+                return {"STATUS": "FAILED", "MESSAGE": f"Not a valid jobs ingest request. Reason: 'Body is not UTF-8. {err}'"}
+            max_rows = int(os.environ["JOBS_INGEST_MAX_ROWS"])
+            if len(lines) > max_rows:
+                return {"STATUS": "FAILED", "MESSAGE": f"Not a valid jobs ingest request. Reason: 'Too many rows. Received {len(lines)}, the maximum is {max_rows}'"}
+            report = await db.run(load_jobs, read_jobs_ndjson(lines), int(os.environ["JOBS_INGEST_BATCH_SIZE"]))
+            return {"STATUS": "SUCCESS" if report["failed"] == 0 else "PARTIAL", **report}
         else:
             return {"STATUS": "FAILED", "MESSAGE": f"Token is Invalid. Reason: '{token_check_message}'"}
     else:
-        logging.warning(f"/jobs/all request failed. No token present. Headers: '{http_request.headers}'")
+        logging.warning("/jobs/ingest request failed. No token present. Reason: '%s'", token_msg)
         return {"STATUS": "FAILED", "MESSAGE": f"Unable to retrieve token from Headers. Reason: '{token_msg}'"}
 
 
-@app.get("/job/{job_id}")
+@router.get("/jobs/changes")
+async def get_job_changes(http_request:Request, since:int|None=None, limit:int|None=None,
+                          timeout:float=Query(0, ge=0, allow_inf_nan=False)):
+    # Long-poll change feed. Returns the jobs inserted/updated after the 'since' cursor, waiting up to 'timeout' seconds for one
+    token_success, token_msg = RequestHandler().check_token_is_present(http_request)
+    if token_success:
+        db = http_request.app.state.db
+        token_valid, token_check_message, _ = await check_request_token(db, token_msg)
+        if token_valid:
+            notifier = http_request.app.state.change_notifier
+            page_size = min(max(limit or int(os.environ["JOBS_PAGE_SIZE"]), 1), int(os.environ["JOBS_MAX_PAGE_SIZE"]))
+            # No cursor means "from now on"
+            since_change_id = since if since is not None else await db.run(DBHandler.get_latest_change_id)
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + min(timeout, float(os.environ["CHANGE_FEED_MAX_WAIT_SECONDS"]))
+            while True:
+                changed = notifier.listen()
+                changes_query_result = await db.run(DBHandler.get_job_changes, since_change_id, page_size)
+                remaining = deadline - loop.time()
+                # A wake up can be for a commit that didn't touch job_status (i.e. a /login token), keep waiting until the deadline
+                if changes_query_result["STATUS"] or remaining <= 0 or not await notifier.wait_for_change(changed, remaining):
+                    break
+            # Checked after the query - if the cursor was still servable now, nothing it needed was pruned before the read
+            if since_change_id < await db.run(DBHandler.get_oldest_change_cursor):
+                return {"STATUS": "FAILED", "MESSAGE": cursor_too_old_message(since_change_id)}
+            body, _ = ResponseHandler().encode_job_changes_response(changes_query_result['ROWS'], since_change_id)
+            return Response(body, media_type="application/json")
+        else:
+            return {"STATUS": "FAILED", "MESSAGE": f"Token is Invalid. Reason: '{token_check_message}'"}
+    else:
+        logging.warning("/jobs/changes request failed. No token present. Reason: '%s'", token_msg)
+        return {"STATUS": "FAILED", "MESSAGE": f"Unable to retrieve token from Headers. Reason: '{token_msg}'"}
+
+
+def cursor_too_old_message(since_change_id:int) -> str:
+    return (f"Cursor {since_change_id} is too old, changes older than {os.environ['JOB_CHANGES_RETENTION_DAYS']} days have been removed. "
+            "Reload /jobs and restart the feed without 'since'")
+
+
+async def stream_job_changes(http_request:Request, token_str:str, since_change_id:int, page_size:int):
+    # Server-Sent Events loop. Sends every batch of changes as a 'jobs' event (id = cursor) and a comment as a keepalive
+    # when nothing changed for CHANGE_FEED_MAX_WAIT_SECONDS. While idle the client only costs a parked coroutine
+    db = http_request.app.state.db
+    notifier = http_request.app.state.change_notifier
+    keepalive_seconds = float(os.environ["CHANGE_FEED_MAX_WAIT_SECONDS"])
+    cursor_checked = False
+    while not await http_request.is_disconnected():
+        changed = notifier.listen()
+        # The token can expire while the stream is open. Cheap thanks to the token cache
+        token_valid, token_check_message, _ = await check_request_token(db, token_str)
+        if not token_valid:
+            yield f"event: error\ndata: Token is Invalid. Reason: '{token_check_message}'\n\n".encode("utf-8")
+            break
+        changes_query_result = await db.run(DBHandler.get_job_changes, since_change_id, page_size)
+        # Only the cursor the client resumed from can be too old. Once streaming, the cursor is ahead of anything pruned
+        if not cursor_checked:
+            if since_change_id < await db.run(DBHandler.get_oldest_change_cursor):
+                yield f"event: error\ndata: {cursor_too_old_message(since_change_id)}\n\n".encode("utf-8")
+                break
+            cursor_checked = True
+        if changes_query_result["STATUS"]:
+            body, since_change_id = ResponseHandler().encode_job_changes_response(changes_query_result['ROWS'], since_change_id)
+            yield f"id: {since_change_id}\nevent: jobs\ndata: ".encode("utf-8") + body + b"\n\n"
+        elif not await notifier.wait_for_change(changed, keepalive_seconds):
+            yield b": keepalive\n\n"
+
+
+@router.get("/jobs/feed")
+async def get_job_feed(http_request:Request, since:int|None=None, limit:int|None=None):
+    token_success, token_msg = RequestHandler().check_token_is_present(http_request)
+    if token_success:
+        db = http_request.app.state.db
+        token_valid, token_check_message, _ = await check_request_token(db, token_msg)
+        if token_valid:
+            page_size = min(max(limit or int(os.environ["JOBS_PAGE_SIZE"]), 1), int(os.environ["JOBS_MAX_PAGE_SIZE"]))
+            # Browsers resume a dropped EventSource with the Last-Event-ID header, which takes priority over ?since=
+            last_event_id = http_request.headers.get("last-event-id")
+            if last_event_id is not None and last_event_id.isdigit():
+                since = int(last_event_id)
+            since_change_id = since if since is not None else await db.run(DBHandler.get_latest_change_id)
+            return StreamingResponse(stream_job_changes(http_request, token_msg, since_change_id, page_size),
+                                     media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+        else:
+            return {"STATUS": "FAILED", "MESSAGE": f"Token is Invalid. Reason: '{token_check_message}'"}
+    else:
+        logging.warning("/jobs/feed request failed. No token present. Reason: '%s'", token_msg)
+        return {"STATUS": "FAILED", "MESSAGE": f"Unable to retrieve token from Headers. Reason: '{token_msg}'"}
+
+
+@router.get("/job/{job_id}")
 async def get_job_info(job_id:str, http_request:Request):
     token_success, token_msg = RequestHandler().check_token_is_present(http_request)
     if token_success:
-        dbh = DBHandler(os.environ["DB_URL"])
-        token_valid, token_check_message = dbh.check_token_is_valid(token_msg)
+        db = http_request.app.state.db
+        token_valid, token_check_message, data_version = await check_request_token(db, token_msg)
         if token_valid:
-            job_query_result = dbh.get_job_by_id(job_id)
-            return ResponseHandler().generate_jobs_response(job_query_result['ROWS'])
+            async def load_job() -> bytes:
+                job_query_result = await db.run(DBHandler.get_job_by_id, job_id)
+                return ResponseHandler().encode_jobs_response(job_query_result['ROWS'])
+            return await cached_jobs_response(http_request, data_version, f"job:{job_id}", load_job)
         else:
             return {"STATUS": "FAILED", "MESSAGE": f"Token is Invalid. Reason: '{token_check_message}'"}
     else:
-        logging.warning(f"/jobs/all request failed. No token present. Headers: '{http_request.headers}'")
+        logging.warning("/jobs/all request failed. No token present. Reason: '%s'", token_msg)
         return {"STATUS": "FAILED", "MESSAGE": f"Unable to retrieve token from Headers. Reason: '{token_msg}'"}
     
 
-logging.basicConfig(level=logging.INFO,
-                    format="%(asctime)s - %(name)s:%(funcName)s:%(lineno)d - %(levelname)s - %(message)s",
-                    # handlers=[logging.StreamHandler(sys.stdout)]
-                    filename="app.log"
-)
+def load_config(path_to_config:str) -> dict:
+    app_cfg = get_config(path_to_config)
+    # Add system config variables to environment.
+    # This setup allows us to be flexible in a kubernetes-like environment where we can open a shell and modify on the fly
+    os.environ["DB_URL"] = app_cfg["DB_URL"]
+    os.environ["API_TOKEN_HOURS_LIFETIME"] = str(app_cfg["API_TOKEN_HOURS_LIFETIME"])
+    os.environ["DB_POOL_SIZE"] = str(app_cfg.get("DB_POOL_SIZE", 5))
+    os.environ["DB_POOL_TIMEOUT_SECONDS"] = str(app_cfg.get("DB_POOL_TIMEOUT_SECONDS", 30))
+    os.environ["DB_STATEMENT_CACHE_SIZE"] = str(app_cfg.get("DB_STATEMENT_CACHE_SIZE", 128))
+    os.environ["DB_JOURNAL_MODE"] = str(app_cfg.get("DB_JOURNAL_MODE", "WAL"))
+    os.environ["DB_SYNCHRONOUS"] = str(app_cfg.get("DB_SYNCHRONOUS", "NORMAL"))
+    os.environ["DB_BUSY_TIMEOUT_MS"] = str(app_cfg.get("DB_BUSY_TIMEOUT_MS", 5000))
+    os.environ["TOKEN_CACHE_SIZE"] = str(app_cfg.get("TOKEN_CACHE_SIZE", 10000))
+    os.environ["TOKEN_CACHE_TTL_SECONDS"] = str(app_cfg.get("TOKEN_CACHE_TTL_SECONDS", 60))
+    os.environ["USER_CACHE_SIZE"] = str(app_cfg.get("USER_CACHE_SIZE", 1000))
+    os.environ["USER_CACHE_TTL_SECONDS"] = str(app_cfg.get("USER_CACHE_TTL_SECONDS", 30))
+    os.environ["DB_MAX_WORKERS"] = str(app_cfg.get("DB_MAX_WORKERS", 4))
+    os.environ["DB_MAX_PENDING"] = str(app_cfg.get("DB_MAX_PENDING", 200))
+    os.environ["JOBS_PAGE_SIZE"] = str(app_cfg.get("JOBS_PAGE_SIZE", 500))
+    os.environ["JOBS_MAX_PAGE_SIZE"] = str(app_cfg.get("JOBS_MAX_PAGE_SIZE", 5000))
+    os.environ["RESPONSE_CACHE_SIZE"] = str(app_cfg.get("RESPONSE_CACHE_SIZE", 256))
+    os.environ["JOBS_LOOKUP_MAX_IDS"] = str(app_cfg.get("JOBS_LOOKUP_MAX_IDS", 5000))
+    os.environ["JOBS_INGEST_MAX_ROWS"] = str(app_cfg.get("JOBS_INGEST_MAX_ROWS", 50000))
+    os.environ["JOBS_INGEST_BATCH_SIZE"] = str(app_cfg.get("JOBS_INGEST_BATCH_SIZE", 1000))
+    os.environ["CHANGE_FEED_POLL_SECONDS"] = str(app_cfg.get("CHANGE_FEED_POLL_SECONDS", 0.5))
+    os.environ["CHANGE_FEED_MAX_WAIT_SECONDS"] = str(app_cfg.get("CHANGE_FEED_MAX_WAIT_SECONDS", 30))
+    os.environ["SLOW_QUERY_THRESHOLD_MS"] = str(app_cfg.get("SLOW_QUERY_THRESHOLD_MS", 0))
+    os.environ["RETENTION_SWEEP_INTERVAL_SECONDS"] = str(app_cfg.get("RETENTION_SWEEP_INTERVAL_SECONDS", 300))
+    os.environ["RETENTION_SWEEP_BATCH_SIZE"] = str(app_cfg.get("RETENTION_SWEEP_BATCH_SIZE", 1000))
+    os.environ["JOB_CHANGES_RETENTION_DAYS"] = str(app_cfg.get("JOB_CHANGES_RETENTION_DAYS", 7))
+    os.environ["PASSWORD_SCRYPT_N"] = str(app_cfg.get("PASSWORD_SCRYPT_N", 16384))
+    os.environ["PASSWORD_SCRYPT_R"] = str(app_cfg.get("PASSWORD_SCRYPT_R", 8))
+    os.environ["PASSWORD_SCRYPT_P"] = str(app_cfg.get("PASSWORD_SCRYPT_P", 1))
+    os.environ["PASSWORD_HASH_WORKERS"] = str(app_cfg.get("PASSWORD_HASH_WORKERS", 2))
+    os.environ["PASSWORD_HASH_MAX_PENDING"] = str(app_cfg.get("PASSWORD_HASH_MAX_PENDING", 100))
+    os.environ["LOG_FILE"] = str(app_cfg.get("LOG_FILE", "app.log"))
+    os.environ["LOG_LEVEL"] = str(app_cfg.get("LOG_LEVEL", "INFO"))
+    os.environ["LOG_MAX_BYTES"] = str(app_cfg.get("LOG_MAX_BYTES", 10485760))
+    os.environ["LOG_BACKUP_COUNT"] = str(app_cfg.get("LOG_BACKUP_COUNT", 5))
+    os.environ["LOG_QUEUE_SIZE"] = str(app_cfg.get("LOG_QUEUE_SIZE", 10000))
+    os.environ["LOG_SAMPLE_RATES"] = json.dumps(app_cfg.get("LOG_SAMPLE_RATES", {}))
+    return app_cfg
+
+
+def configure_app_logging() -> None:
+    # Log lines are queued and written to LOG_FILE by a background thread, see libs/LogHandler.py
+    configure_logging(log_file=os.environ["LOG_FILE"], level=os.environ["LOG_LEVEL"],
+                      max_bytes=int(os.environ["LOG_MAX_BYTES"]), backup_count=int(os.environ["LOG_BACKUP_COUNT"]),
+                      queue_size=int(os.environ["LOG_QUEUE_SIZE"]))
 
 
-## Load configuration file
-app_cfg = get_config("config/app-config-dev.json")
-# Add system config variables to environment.
-# This setup allows us to be flexible in a kubernetes-like environment where we can open a shell and modify on the fly
-os.environ["DB_URL"] = app_cfg["DB_URL"]
-os.environ["API_TOKEN_HOURS_LIFETIME"] = str(app_cfg["API_TOKEN_HOURS_LIFETIME"])
+def create_app() -> FastAPI:
+    # App factory - uvicorn calls this in every worker process, so each worker gets its own pool, caches and background tasks
+    # API_CONFIG points the app at another config file, i.e. the benchmark database (see benchmarks/README.md)
+    load_config(os.environ.get("API_CONFIG", "config/app-config-dev.json"))
+    configure_app_logging()
+    app = FastAPI(lifespan=lifespan)
+    # Times every request, per route template, for /metrics
+    app.add_middleware(MetricsMiddleware)
+    # Applies LOG_SAMPLE_RATES to the INFO lines written while serving a request
+    app.add_middleware(LogContextMiddleware, sample_rates=json.loads(os.environ["LOG_SAMPLE_RATES"]))
+    app.include_router(router)
+    logging.info("Worker %d started", os.getpid())
+    return app
 
-logging.info(f"API will run on host {app_cfg['API_HOST']} and port {app_cfg['API_PORT']}")
 
-uvicorn.run(app, host=app_cfg['API_HOST'], port=app_cfg['API_PORT'])
-logging.info("API is now available")
\ No newline at end of file
+if __name__ == "__main__":
+    app_cfg = load_config(os.environ.get("API_CONFIG", "config/app-config-dev.json"))
+    configure_app_logging()
+    api_workers = int(app_cfg.get("API_WORKERS", 1))
+    logging.info("API will run on host %s and port %s with %d worker(s)", app_cfg['API_HOST'], app_cfg['API_PORT'], api_workers)
+    # The factory is passed as an import string so uvicorn can start it in each worker process.
+    # With more than one worker, SIGHUP to the main process restarts the workers one at a time (graceful reload)
+    # and in-flight requests get API_GRACEFUL_SHUTDOWN_SECONDS to finish before a worker is stopped
+    uvicorn.run("app:create_app", factory=True, host=app_cfg['API_HOST'], port=app_cfg['API_PORT'], workers=api_workers,
+                timeout_graceful_shutdown=app_cfg.get("API_GRACEFUL_SHUTDOWN_SECONDS", 30))
@@ -0,0 +1,41 @@
+import argparse, json
+
+
+# Compares two load_test.py result files scenario by scenario, i.e. before/after a change to the handlers
+#
+#   python -m benchmarks.compare_results benchmarks/results/baseline-....json benchmarks/results/candidate-....json
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("baseline", help="Result file of the reference run")
+    parser.add_argument("candidate", help="Result file of the run to compare")
+
+    return parser.parse_args()
+
+
+def load_results(path:str) -> dict:
+    with open(path) as results_f:
+        return json.load(results_f)
+
+
+def pct_change(baseline:float, candidate:float) -> str:
+    if baseline == 0:
+        return "n/a"
+    return f"{(candidate - baseline) / baseline * 100:+.1f}%"
+
+
+if __name__ == '__main__':
+    args = get_args()
+    baseline, candidate = load_results(args.baseline), load_results(args.candidate)
+    print(f"baseline:  {baseline['label']} ({baseline['timestamp']}) concurrency={baseline['concurrency']}")
+    print(f"candidate: {candidate['label']} ({candidate['timestamp']}) concurrency={candidate['concurrency']}\n")
+    print(f"{'scenario':<12}{'metric':<10}{'baseline':>12}{'candidate':>12}{'change':>10}")
+    for scenario in baseline["results"]:
+        if scenario not in candidate["results"]:
+            continue
+        base_result, cand_result = baseline["results"][scenario], candidate["results"][scenario]
+        rows = [("req/s", base_result["throughput_rps"], cand_result["throughput_rps"])]
+        rows += [(f"{name} ms", base_result["latency_ms"][name], cand_result["latency_ms"][name]) for name in ("p50", "p95", "p99")]
+        rows.append(("errors", base_result["errors"], cand_result["errors"]))
+        for metric, base_value, cand_value in rows:
+            print(f"{scenario:<12}{metric:<10}{base_value:>12.2f}{cand_value:>12.2f}{pct_change(base_value, cand_value):>10}")
@@ -0,0 +1,133 @@
+import argparse, asyncio, json, os, logging, sys, time, random, datetime, platform, statistics
+
+import httpx
+
+
+# Drives a running API with concurrent clients and reports throughput and latency percentiles per scenario.
+# Results are saved as JSON so runs can be compared with benchmarks/compare_results.py
+#
+# Run from the repo root, against an API started on a seeded database (see benchmarks/README.md):
+#   python -m benchmarks.load_test --scenario jobs_page job --concurrency 32 --requests 5000 --label baseline
+
+SCENARIOS = ("login", "jobs", "jobs_page", "job")
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Load test the API endpoints")
+    parser.add_argument("--base-url", help="Where the API is running", default="http://127.0.0.1:8000")
+    parser.add_argument("--seed-file", help="Seed file written by seed_database.py", default="benchmarks/seed.json")
+    parser.add_argument("--scenario", help="Scenario(s) to run, one after the other", nargs="+", choices=SCENARIOS, default=["job"])
+    parser.add_argument("--concurrency", help="Number of concurrent clients", type=int, default=16)
+    parser.add_argument("--requests", help="Requests per scenario", type=int, default=2000)
+    parser.add_argument("--warmup", help="Requests per scenario that are sent but not measured", type=int, default=50)
+    parser.add_argument("--page-size", help="limit used by the jobs_page scenario", type=int, default=500)
+    parser.add_argument("--timeout", help="Per request timeout in seconds", type=float, default=60)
+    parser.add_argument("--label", help="Name for this run, stored with the results", default="run")
+    parser.add_argument("--output", help="Results file (JSON). Defaults to benchmarks/results/<label>-<timestamp>.json", default="")
+
+    return parser.parse_args()
+
+
+def percentile(sorted_values:list[float], pct:float) -> float:
+    # Nearest-rank percentile, good enough for latency reporting
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(pct / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def build_request(scenario:str, seed:dict, page_size:int) -> tuple[str, str, dict]:
+    # Returns (method, path, httpx kwargs) for one request of the scenario
+    match scenario:
+        case "login":
+            user = random.choice(seed["login_users"])
+            return "POST", "/login", {"json": {"username": user["username"], "password": user["password"]}}
+        case "jobs":
+            return "GET", "/jobs", {"headers": {"Authorization": f"Bearer {random.choice(seed['tokens'])}"}}
+        case "jobs_page":
+            after_job_id = random.randint(0, max(seed["max_job_id"] - page_size, 0))
+            return "GET", f"/jobs?after_job_id={after_job_id}&limit={page_size}", {"headers": {"Authorization": f"Bearer {random.choice(seed['tokens'])}"}}
+        case "job":
+            return "GET", f"/job/{random.randint(1, max(seed['max_job_id'], 1))}", {"headers": {"Authorization": f"Bearer {random.choice(seed['tokens'])}"}}
+
+
+async def run_scenario(client:httpx.AsyncClient, scenario:str, seed:dict, args) -> dict:
+    latencies = []
+    errors = 0
+    remaining = {"warmup": args.warmup, "measured": args.requests}
+
+    async def worker():
+        nonlocal errors
+        while True:
+            if remaining["warmup"] > 0:
+                remaining["warmup"] -= 1
+                measured = False
+            elif remaining["measured"] > 0:
+                remaining["measured"] -= 1
+                measured = True
+            else:
+                return
+            method, path, request_kwargs = build_request(scenario, seed, args.page_size)
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, path, **request_kwargs)
+                # The API reports failures in the body ({"STATUS": "FAILED"}), not only through the status code
+                failed = response.status_code >= 400 or response.content.startswith(b'{"STATUS":"FAILED"')
+            except httpx.HTTPError as err:
+                logging.warning(f"{scenario} request failed. '{err}'")
+                failed = True
+            elapsed = time.perf_counter() - started
+            if measured:
+                latencies.append(elapsed)
+                errors += failed
+
+    # Warmup is spread over the workers too, the measured window starts once it is used up
+    scenario_started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    duration = time.perf_counter() - scenario_started
+
+    latencies.sort()
+    latency_ms = {"p50": percentile(latencies, 50) * 1000, "p95": percentile(latencies, 95) * 1000,
+                  "p99": percentile(latencies, 99) * 1000, "mean": statistics.fmean(latencies) * 1000 if latencies else 0.0,
+                  "max": latencies[-1] * 1000 if latencies else 0.0}
+    return {"requests": len(latencies), "errors": errors, "duration_s": duration,
+            "throughput_rps": len(latencies) / duration if duration > 0 else 0.0,
+            "latency_ms": {name: round(value, 3) for name, value in latency_ms.items()}}
+
+
+async def main(args) -> dict:
+    with open(args.seed_file) as seed_file_f:
+        seed = json.load(seed_file_f)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    results = {}
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+        for scenario in args.scenario:
+            logging.info(f"Running scenario '{scenario}' - {args.requests} requests at concurrency {args.concurrency}")
+            results[scenario] = await run_scenario(client, scenario, seed, args)
+            logging.info(f"{scenario}: {results[scenario]}")
+    return results
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO,
+                        format="%(asctime)s - %(funcName)s:%(lineno)d - %(levelname)s - %(message)s",
+                        handlers=[logging.StreamHandler(sys.stdout)]
+    )
+    args = get_args()
+    results = asyncio.run(main(args))
+
+    run_timestamp = datetime.datetime.now(datetime.timezone.utc)
+    output_path = args.output or os.path.join("benchmarks", "results", f"{args.label}-{run_timestamp.strftime('%Y%m%dT%H%M%SZ')}.json")
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    run_details = {"label": args.label, "timestamp": run_timestamp.isoformat(), "base_url": args.base_url,
+                   "concurrency": args.concurrency, "requests": args.requests, "warmup": args.warmup, "page_size": args.page_size,
+                   "python": platform.python_version(), "platform": platform.platform(), "results": results}
+    with open(output_path, "w") as output_f:
+        json.dump(run_details, output_f, indent=2)
+
+    print(f"\n{'scenario':<12}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for scenario, result in results.items():
+        latency_ms = result["latency_ms"]
+        print(f"{scenario:<12}{result['requests']:>10}{result['errors']:>8}{result['throughput_rps']:>10.1f}"
+              f"{latency_ms['p50']:>10.2f}{latency_ms['p95']:>10.2f}{latency_ms['p99']:>10.2f}")
+    print(f"\nResults saved to '{output_path}'")
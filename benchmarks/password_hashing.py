@@ -0,0 +1,72 @@
+import argparse, json, os, logging, sys, time, datetime, platform, statistics, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from libs.AuthHandler import hash_password, verify_password
+
+
+# Measures the cost of the password hash behind /login for a set of scrypt work factors:
+# single verify latency, and verify throughput when spread over a process pool (as AsyncAuthHandler does).
+# Use it to pick PASSWORD_SCRYPT_* and PASSWORD_HASH_WORKERS before running the login scenario of load_test.py
+#
+# Run from the repo root:
+#   python -m benchmarks.password_hashing --n 16384 32768 65536 --workers 1 2 4 --verifies 200
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Benchmark scrypt password verification")
+    parser.add_argument("--n", help="scrypt cost values to try (powers of 2)", type=int, nargs="+", default=[2 ** 14, 2 ** 15])
+    parser.add_argument("--r", help="scrypt block size", type=int, default=8)
+    parser.add_argument("--p", help="scrypt parallelism", type=int, default=1)
+    parser.add_argument("--workers", help="Process pool sizes to try for the throughput test", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--verifies", help="Verifications per measurement", type=int, default=100)
+    parser.add_argument("--label", help="Name for this run, stored with the results", default="password-hashing")
+    parser.add_argument("--output", help="Results file (JSON). Defaults to benchmarks/results/<label>-<timestamp>.json", default="")
+
+    return parser.parse_args()
+
+
+def measure_latency(password_hash:str, verifies:int) -> dict:
+    latencies = []
+    for _ in range(verifies):
+        started = time.perf_counter()
+        verify_password("benchPassword", password_hash)
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    return {"mean_ms": round(statistics.fmean(latencies) * 1000, 3), "p50_ms": round(latencies[len(latencies) // 2] * 1000, 3),
+            "max_ms": round(latencies[-1] * 1000, 3)}
+
+
+def measure_throughput(password_hash:str, verifies:int, workers:int) -> float:
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as hash_pool:
+        # Start every worker before the clock does
+        list(hash_pool.map(verify_password, ["benchPassword"] * workers, [password_hash] * workers))
+        started = time.perf_counter()
+        list(hash_pool.map(verify_password, ["benchPassword"] * verifies, [password_hash] * verifies))
+        return verifies / (time.perf_counter() - started)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO,
+                        format="%(asctime)s - %(funcName)s:%(lineno)d - %(levelname)s - %(message)s",
+                        handlers=[logging.StreamHandler(sys.stdout)]
+    )
+    args = get_args()
+    results = {}
+    for n in args.n:
+        password_hash = hash_password("benchPassword", n, args.r, args.p)
+        latency = measure_latency(password_hash, max(args.verifies // 10, 5))
+        throughput = {workers: round(measure_throughput(password_hash, args.verifies, workers), 1) for workers in args.workers}
+        results[str(n)] = {"memory_mb": round(128 * n * args.r / 2 ** 20, 1), "latency": latency, "verifies_per_s": throughput}
+        logging.info(f"n={n}: {results[str(n)]}")
+
+    run_timestamp = datetime.datetime.now(datetime.timezone.utc)
+    output_path = args.output or os.path.join("benchmarks", "results", f"{args.label}-{run_timestamp.strftime('%Y%m%dT%H%M%SZ')}.json")
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with open(output_path, "w") as output_f:
+        json.dump({"label": args.label, "timestamp": run_timestamp.isoformat(), "r": args.r, "p": args.p, "cpu_count": os.cpu_count(),
+                   "python": platform.python_version(), "platform": platform.platform(), "results": results}, output_f, indent=2)
+
+    print(f"\n{'n':>8}{'MB':>8}{'verify ms':>12}" + "".join(f"{f'{workers} proc/s':>12}" for workers in args.workers))
+    for n, result in results.items():
+        print(f"{n:>8}{result['memory_mb']:>8}{result['latency']['p50_ms']:>12.2f}"
+              + "".join(f"{result['verifies_per_s'][workers]:>12.1f}" for workers in args.workers))
+    print(f"\nResults saved to '{output_path}'")
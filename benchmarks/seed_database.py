@@ -0,0 +1,118 @@
+import argparse, json, os, logging, sys, sqlite3, datetime, secrets, functools
+from concurrent.futures import ProcessPoolExecutor
+
+from create_table_and_add_user import (CREATE_API_USERS_TABLE_QUERY, CREATE_TOKEN_JOURNAL_TABLE_QUERY, CREATE_TOKEN_JOURNAL_INDEX_QUERIES,
+                                       CREATE_TOKEN_REVOCATIONS_TABLE_QUERY, CREATE_TOKEN_JOURNAL_TRIGGER_QUERIES,
+                                       CREATE_JOB_STATUS_TABLE_QUERY, CREATE_JOB_STATUS_INDEX_QUERIES,
+                                       CREATE_JOB_STATUS_CHANGES_TABLE_QUERY, CREATE_JOB_STATUS_CHANGES_INDEX_QUERIES,
+                                       CREATE_JOB_STATUS_TRIGGER_QUERIES)
+from libs.DBHandler import JOB_TIME_FORMAT
+from libs.AuthHandler import hash_password, DEFAULT_SCRYPT_N, DEFAULT_SCRYPT_R, DEFAULT_SCRYPT_P
+
+
+# Builds a throwaway database with the API's schema and a configurable amount of data for the load tests.
+# Writes a seed file next to it with the credentials/tokens/job ids load_test.py drives the API with
+#
+# Run from the repo root:
+#   python -m benchmarks.seed_database --db bench_database.db --users 200 --jobs 100000
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Seed a SQLite database for the API benchmarks")
+    parser.add_argument("--db", help="Path of the database to create", default="bench_database.db")
+    parser.add_argument("--seed-file", help="Where to write the seed details used by load_test.py", default="benchmarks/seed.json")
+    parser.add_argument("--users", help="Number of api_users rows", type=int, default=200)
+    parser.add_argument("--tokens", help="Number of users that get a valid token up front. The rest are used by the login scenario",
+                        type=int, default=100)
+    parser.add_argument("--jobs", help="Number of job_status rows (i.e. 1000 to 1000000)", type=int, default=100000)
+    parser.add_argument("--running-ratio", help="Share of jobs with no end_time", type=float, default=0.1)
+    parser.add_argument("--token-hours", help="Lifetime of the seeded tokens", type=int, default=24)
+    parser.add_argument("--batch-size", help="Rows per executemany() batch", type=int, default=10000)
+    # Keep these in line with PASSWORD_SCRYPT_* in the config the API runs with, otherwise every login also rehashes
+    parser.add_argument("--scrypt-n", help="scrypt cost for the seeded password hashes", type=int, default=DEFAULT_SCRYPT_N)
+    parser.add_argument("--scrypt-r", help="scrypt block size for the seeded password hashes", type=int, default=DEFAULT_SCRYPT_R)
+    parser.add_argument("--scrypt-p", help="scrypt parallelism for the seeded password hashes", type=int, default=DEFAULT_SCRYPT_P)
+    parser.add_argument("-f", "--force", help="Overwrite the database if it already exists", default=False, action="store_true")
+
+    return parser.parse_args()
+
+
+def create_schema(connection:sqlite3.Connection) -> None:
+    for create_query in (CREATE_API_USERS_TABLE_QUERY, CREATE_TOKEN_JOURNAL_TABLE_QUERY, CREATE_JOB_STATUS_TABLE_QUERY,
+                         CREATE_JOB_STATUS_CHANGES_TABLE_QUERY, CREATE_TOKEN_REVOCATIONS_TABLE_QUERY,
+                         *CREATE_TOKEN_JOURNAL_INDEX_QUERIES.values(), *CREATE_TOKEN_JOURNAL_TRIGGER_QUERIES.values(),
+                         *CREATE_JOB_STATUS_INDEX_QUERIES.values(), *CREATE_JOB_STATUS_CHANGES_INDEX_QUERIES.values(),
+                         *CREATE_JOB_STATUS_TRIGGER_QUERIES.values()):
+        connection.execute(create_query)
+    connection.commit()
+
+
+def seed_users(connection:sqlite3.Connection, user_count:int, scrypt_params:tuple[int, int, int]) -> list[dict]:
+    # Plaintext passwords go to the seed file for the login scenario, the database only gets their hashes.
+    # Hashing is slow by design, so it is spread over every core
+    users = [{"username": f"benchuser{idx}", "password": f"benchPassword{idx}"} for idx in range(user_count)]
+    with ProcessPoolExecutor() as hash_pool:
+        n, r, p = scrypt_params
+        password_hashes = list(hash_pool.map(functools.partial(hash_password, n=n, r=r, p=p),
+                                             (user["password"] for user in users), chunksize=16))
+    connection.executemany("INSERT INTO api_users(username, email, password) VALUES (?, ?, ?);",
+                           ((user["username"], f"{user['username']}@bench.local", password_hash)
+                            for user, password_hash in zip(users, password_hashes)))
+    connection.commit()
+    return users
+
+
+def seed_tokens(connection:sqlite3.Connection, token_count:int, token_hours:int) -> list[str]:
+    # Epoch seconds, same as DBHandler.register_new_token()
+    expiry = int((datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=token_hours)).timestamp())
+    user_ids = [row[0] for row in connection.execute("SELECT user_id FROM api_users ORDER BY user_id LIMIT ?;", (token_count,))]
+    tokens = [secrets.token_hex(32) for _ in user_ids]
+    connection.executemany("INSERT INTO user_token_journal(user_id, token, expiry) VALUES (?, ?, ?);",
+                           ((user_id, token, expiry) for user_id, token in zip(user_ids, tokens)))
+    connection.commit()
+    return tokens
+
+
+def seed_jobs(connection:sqlite3.Connection, job_count:int, running_ratio:float, batch_size:int) -> None:
+    # Jobs are spread over the last 30 days so the start_time filters have something to range scan
+    now = datetime.datetime.now(datetime.timezone.utc)
+    running_every = int(1 / running_ratio) if running_ratio > 0 else 0
+    for batch_start in range(0, job_count, batch_size):
+        batch = []
+        for idx in range(batch_start, min(batch_start + batch_size, job_count)):
+            start_time = now - datetime.timedelta(seconds=(job_count - idx) * 30 * 86400 // job_count)
+            running = running_every > 0 and idx % running_every == 0
+            end_time = None if running else (start_time + datetime.timedelta(minutes=idx % 120 + 1)).strftime(JOB_TIME_FORMAT)
+            batch.append((f"BenchProgram{idx}.sh", start_time.strftime(JOB_TIME_FORMAT), end_time, f"-run {idx} -env BENCH"))
+        connection.executemany("INSERT INTO job_status(program, start_time, end_time, params) VALUES (?, ?, ?, ?);", batch)
+        connection.commit()
+        logging.info(f"Seeded {min(batch_start + batch_size, job_count)}/{job_count} jobs")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO,
+                        format="%(asctime)s - %(funcName)s:%(lineno)d - %(levelname)s - %(message)s",
+                        handlers=[logging.StreamHandler(sys.stdout)]
+    )
+    args = get_args()
+    logging.info(f"Arguments: {args}")
+    if os.path.exists(args.db):
+        if not args.force:
+            logging.error(f"Database '{args.db}' already exists. Use --force to overwrite it")
+            sys.exit(1)
+        os.remove(args.db)
+
+    connection = sqlite3.connect(args.db)
+    create_schema(connection)
+    users = seed_users(connection, args.users, (args.scrypt_n, args.scrypt_r, args.scrypt_p))
+    tokens = seed_tokens(connection, min(args.tokens, args.users), args.token_hours)
+    seed_jobs(connection, args.jobs, args.running_ratio, args.batch_size)
+    max_job_id = connection.execute("SELECT MAX(job_id) FROM job_status;").fetchone()[0] or 0
+    connection.close()
+
+    # /login replaces a user's token, so the login scenario only uses the users that don't hold one of the seeded tokens
+    seed_details = {"db": args.db, "login_users": users[len(tokens):] or users, "tokens": tokens,
+                    "job_count": args.jobs, "max_job_id": max_job_id}
+    with open(args.seed_file, "w") as seed_file_f:
+        json.dump(seed_details, seed_file_f)
+    logging.info(f"Seeded '{args.db}' with {args.users} users, {len(tokens)} tokens and {args.jobs} jobs. Seed file: '{args.seed_file}'")
@@ -1,12 +1,94 @@
 import argparse, json, os, logging, sys, sqlite3, datetime
-from libs.DBHandler import DBHandler
+from libs.DBHandler import DBHandler, normalize_job_time
+from libs.AuthHandler import hash_password, PASSWORD_HASH_SCHEME
+from libs.CustomExceptions import InvalidInputError
 
 
 
+# Schema - module level so other tooling (i.e. benchmarks/) can build the same tables
+CREATE_API_USERS_TABLE_QUERY='''CREATE TABLE api_users(
+    user_id INTEGER PRIMARY KEY ,
+    username TEXT UNIQUE,
+    email TEXT UNIQUE,
+    password TEXT
+    );'''
+
+# expiry is epoch seconds (UTC), so the token check and the expired token sweep compare plain integers
+CREATE_TOKEN_JOURNAL_TABLE_QUERY='''CREATE TABLE user_token_journal(
+    user_id INTEGER,
+    token TEXT UNIQUE,
+    expiry INTEGER,
+    FOREIGN KEY (user_id) REFERENCES api_users(user_id)
+    );'''
+
+# expiry is behind the expired token sweep (DELETE ... WHERE expiry <= now).
+# user_id is UNIQUE so a user holds at most one token, /login upserts on it (ON CONFLICT(user_id))
+CREATE_TOKEN_JOURNAL_INDEX_QUERIES = {
+    "idx_user_token_journal_user_id": "CREATE UNIQUE INDEX IF NOT EXISTS idx_user_token_journal_user_id ON user_token_journal(user_id);",
+    "idx_user_token_journal_expiry": "CREATE INDEX IF NOT EXISTS idx_user_token_journal_expiry ON user_token_journal(expiry);",
+}
+
+# Tokens replaced by /login or deleted before they expired, recorded by the triggers below. Every API worker reads the new
+# rows when the database changes and drops just those tokens from its token cache (see DBHandler.TokenRevocations).
+# A row is swept once its token would have expired anyway
+CREATE_TOKEN_REVOCATIONS_TABLE_QUERY='''CREATE TABLE IF NOT EXISTS user_token_revocations(
+    revocation_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    token TEXT NOT NULL,
+    expiry INTEGER
+    );'''
+
+CREATE_TOKEN_JOURNAL_TRIGGER_QUERIES = {
+    "trg_user_token_journal_replace": '''CREATE TRIGGER IF NOT EXISTS trg_user_token_journal_replace AFTER UPDATE OF token ON user_token_journal
+    WHEN OLD.token IS NOT NEW.token
+    BEGIN INSERT INTO user_token_revocations(token, expiry) VALUES (OLD.token, OLD.expiry); END;''',
+    "trg_user_token_journal_delete": '''CREATE TRIGGER IF NOT EXISTS trg_user_token_journal_delete AFTER DELETE ON user_token_journal
+    WHEN OLD.expiry > CAST(strftime('%s', 'now') AS INTEGER)
+    BEGIN INSERT INTO user_token_revocations(token, expiry) VALUES (OLD.token, OLD.expiry); END;''',
+}
+
+CREATE_JOB_STATUS_TABLE_QUERY='''CREATE TABLE job_status(
+    job_id INTEGER PRIMARY KEY,
+    program TEXT UNIQUE,
+    start_time TEXT,
+    end_time TEXT,
+    params TEXT
+    );'''
+
+# Indexes behind the /jobs filters. program is already covered by its UNIQUE index.
+# The running filter (end_time IS NULL) uses a partial index so it only holds the jobs still running
+CREATE_JOB_STATUS_INDEX_QUERIES = {
+    "idx_job_status_running": "CREATE INDEX IF NOT EXISTS idx_job_status_running ON job_status(job_id) WHERE end_time IS NULL;",
+    "idx_job_status_start_time": "CREATE INDEX IF NOT EXISTS idx_job_status_start_time ON job_status(start_time);",
+}
+
+# Change journal behind /jobs/changes and /jobs/feed. Triggers record every insert/update on job_status whoever the writer is,
+# change_id is the cursor clients read from. AUTOINCREMENT so ids are never reused.
+# changed_at is epoch seconds (UTC), the sweeper deletes changes older than JOB_CHANGES_RETENTION_DAYS
+CREATE_JOB_STATUS_CHANGES_TABLE_QUERY='''CREATE TABLE IF NOT EXISTS job_status_changes(
+    change_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id INTEGER NOT NULL,
+    changed_at INTEGER
+    );'''
+
+CREATE_JOB_STATUS_TRIGGER_QUERIES = {
+    "trg_job_status_insert": '''CREATE TRIGGER IF NOT EXISTS trg_job_status_insert AFTER INSERT ON job_status
+    BEGIN INSERT INTO job_status_changes(job_id, changed_at) VALUES (NEW.job_id, CAST(strftime('%s', 'now') AS INTEGER)); END;''',
+    "trg_job_status_update": '''CREATE TRIGGER IF NOT EXISTS trg_job_status_update AFTER UPDATE ON job_status
+    BEGIN INSERT INTO job_status_changes(job_id, changed_at) VALUES (NEW.job_id, CAST(strftime('%s', 'now') AS INTEGER)); END;''',
+}
+
+# Behind the change journal retention sweep (DELETE ... WHERE changed_at < cutoff)
+CREATE_JOB_STATUS_CHANGES_INDEX_QUERIES = {
+    "idx_job_status_changes_changed_at": "CREATE INDEX IF NOT EXISTS idx_job_status_changes_changed_at ON job_status_changes(changed_at);",
+}
+
+
 def get_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("-c", "--config", help="Path to the config file", default="../config/app-config.dev.json")
     parser.add_argument("-d", "--drop", help="Flag to drop table ", default=False, action="store_true")
+    parser.add_argument("-m", "--migrate", help="Flag to migrate an existing database (indexes/data) instead of creating tables",
+                        default=False, action="store_true")
 
     return parser.parse_args()
 
@@ -34,6 +116,126 @@ def create_table(dbh:DBHandler, sql_statement:str, table_name:str, drop_table:bo
         return False
 
 
+def create_schema_object(dbh:DBHandler, sql_statement:str, object_name:str) -> bool:
+    # Indexes/triggers/tables created with IF NOT EXISTS, so this is safe to re-run during a migration
+    logging.info(f"Attempting Create: {object_name}")
+    object_create_response = dbh.execute_query(sql_statement, "create")
+    if object_create_response["STATUS"]:
+        logging.info(f"Created '{object_name}'")
+        dbh.connection.commit()
+        return True
+    else:
+        logging.error(f"Failed to create '{object_name}'")
+        return False
+
+
+def backfill_job_changes(dbh:DBHandler) -> None:
+    # Seed the change journal with the jobs that existed before it, so a feed read from cursor 0 replays every job
+    if dbh.execute_query("SELECT 1 FROM job_status_changes LIMIT 1;", "select")["STATUS"]:
+        return
+    backfill_response = dbh.execute_query('''INSERT INTO job_status_changes(job_id, changed_at)
+                                             SELECT job_id, CAST(strftime('%s', 'now') AS INTEGER) FROM job_status ORDER BY job_id;''',
+                                          "insert", commit_flag=True)
+    logging.info(f"Backfilled job_status_changes with {backfill_response['ROWS'][0]} jobs")
+
+
+def migrate_job_changes_changed_at(dbh:DBHandler) -> bool:
+    # Adds changed_at to a change journal created before retention. Rows already there are stamped with the time of the
+    # migration, so they are kept for a full retention period. The old triggers don't set changed_at, they are dropped
+    # here and recreated from CREATE_JOB_STATUS_TRIGGER_QUERIES
+    journal_columns = [column[1] for column in dbh.client.execute("PRAGMA table_info(job_status_changes);").fetchall()]
+    if "changed_at" in journal_columns:
+        logging.info("job_status_changes.changed_at already exists")
+        return False
+    try:
+        dbh.client.execute("BEGIN;")
+        dbh.client.execute("ALTER TABLE job_status_changes ADD COLUMN changed_at INTEGER;")
+        dbh.client.execute("UPDATE job_status_changes SET changed_at = CAST(strftime('%s', 'now') AS INTEGER);")
+        for trigger_name in CREATE_JOB_STATUS_TRIGGER_QUERIES:
+            dbh.client.execute(f"DROP TRIGGER IF EXISTS {trigger_name};")
+        dbh.connection.commit()
+    except sqlite3.Error as err:
+        dbh.connection.rollback()
+        logging.error(f"Unable to add changed_at to job_status_changes, left unchanged. '{err}'")
+        return False
+    logging.info("Added changed_at to job_status_changes")
+    return True
+
+
+def migrate_job_times(dbh:DBHandler) -> int:
+    # Rewrites start_time/end_time as UTC in the fixed width JOB_TIME_FORMAT so they sort (and range scan) correctly as text
+    job_times_result = dbh.execute_query("SELECT job_id, start_time, end_time FROM job_status;", "select")
+    migrated_rows = 0
+    for job_id, start_time, end_time in job_times_result["ROWS"]:
+        try:
+            new_start_time, new_end_time = normalize_job_time(start_time), normalize_job_time(end_time)
+        except InvalidInputError as err:
+            logging.error(f"Unable to migrate times for job #{job_id}, row left unchanged. '{err}'")
+            continue
+        if (new_start_time, new_end_time) != (start_time, end_time):
+            dbh.execute_query("UPDATE job_status SET start_time = ?, end_time = ? WHERE job_id = ?;", "update",
+                              params=(new_start_time, new_end_time, job_id))
+            migrated_rows += 1
+    dbh.connection.commit()
+    logging.info(f"Migrated start_time/end_time on {migrated_rows} job_status rows")
+    return migrated_rows
+
+
+def migrate_token_expiry(dbh:DBHandler) -> bool:
+    # Rebuilds user_token_journal with expiry as epoch seconds. SQLite can't change a column's type in place,
+    # so the rows are copied into a new table which then replaces the old one, all in one transaction
+    expiry_column = [column for column in dbh.client.execute("PRAGMA table_info(user_token_journal);").fetchall() if column[1] == "expiry"]
+    if expiry_column and expiry_column[0][2].upper() == "INTEGER":
+        logging.info("user_token_journal.expiry is already INTEGER")
+        return False
+    token_rows = dbh.execute_query("SELECT user_id, token, expiry FROM user_token_journal;", "select")["ROWS"]
+    migrated_rows = []
+    for user_id, token, expiry in token_rows:
+        try:
+            expiry_epoch = int(datetime.datetime.strptime(expiry, "%Y-%m-%d %H:%M:%S.%f %z").timestamp())
+        except (TypeError, ValueError) as err:
+            # Unreadable expiry - keep the row but treat the token as expired, the sweep removes it
+            logging.error(f"Unable to read expiry for User #{user_id}, token marked expired. '{err}'")
+            expiry_epoch = 0
+        migrated_rows.append((user_id, token, expiry_epoch))
+    try:
+        dbh.client.execute("BEGIN;")
+        dbh.client.execute(CREATE_TOKEN_JOURNAL_TABLE_QUERY.replace("user_token_journal(", "user_token_journal_new(", 1))
+        dbh.client.executemany("INSERT INTO user_token_journal_new(user_id, token, expiry) VALUES (?, ?, ?);", migrated_rows)
+        dbh.client.execute("DROP TABLE user_token_journal;")
+        dbh.client.execute("ALTER TABLE user_token_journal_new RENAME TO user_token_journal;")
+        dbh.connection.commit()
+    except sqlite3.Error as err:
+        dbh.connection.rollback()
+        logging.error(f"Unable to migrate user_token_journal, left unchanged. '{err}'")
+        return False
+    logging.info(f"Rebuilt user_token_journal with INTEGER expiry ({len(migrated_rows)} tokens)")
+    return True
+
+
+def dedupe_user_tokens(dbh:DBHandler) -> int:
+    # Concurrent first logins could leave a user with several user_token_journal rows. Keeps the newest row per user,
+    # so the UNIQUE user_id index can be created
+    dedupe_response = dbh.execute_query('''DELETE FROM user_token_journal WHERE rowid NOT IN
+                                           (SELECT MAX(rowid) FROM user_token_journal GROUP BY user_id);''', "delete", commit_flag=True)
+    logging.info(f"Removed {dedupe_response['ROWS'][0]} duplicate user_token_journal rows")
+    return dedupe_response["ROWS"][0]
+
+
+def migrate_passwords(dbh:DBHandler, n:int, r:int, p:int) -> int:
+    # Replaces plaintext passwords with scrypt hashes. Rows already hashed are left alone, so this is safe to re-run
+    users_result = dbh.execute_query("SELECT user_id, password FROM api_users;", "select")
+    migrated_rows = 0
+    for user_id, password in users_result["ROWS"]:
+        if password is None or password.startswith(f"{PASSWORD_HASH_SCHEME}$"):
+            continue
+        dbh.execute_query("UPDATE api_users SET password = ? WHERE user_id = ?;", "update", params=(hash_password(password, n, r, p), user_id))
+        migrated_rows += 1
+    dbh.connection.commit()
+    logging.info(f"Hashed the password of {migrated_rows} api_users rows")
+    return migrated_rows
+
+
 def insert_row(dbh:DBHandler, sql_statement:str)-> bool:
     logging.info(f"Attempting Insert Row: {sql_statement}")
     insert_row_response = dbh.execute_query(sql_statement, "insert")
@@ -49,32 +251,9 @@ def insert_row(dbh:DBHandler, sql_statement:str)-> bool:
 
 if __name__ == '__main__':
 
-    CREATE_API_USERS_TABLE_QUERY='''CREATE TABLE api_users(
-    user_id INTEGER PRIMARY KEY ,
-    username TEXT UNIQUE,
-    email TEXT UNIQUE,
-    password TEXT
-    );'''
-
-    # Sqlite does not support Date Type Columns - Will use an ISO String representation
-    CREATE_TOKEN_JOURNAL_TABLE_QUERY='''CREATE TABLE user_token_journal(
-    user_id INTEGER,
-    token TEXT UNIQUE,
-    expiry TEXT,
-    FOREIGN KEY (user_id) REFERENCES api_users(user_id)
-    );'''
-
-    CREATE_JOB_STATUS_TABLE_QUERY='''CREATE TABLE job_status(
-    job_id INTEGER PRIMARY KEY,
-    program TEXT UNIQUE,
-    start_time TEXT,
-    end_time TEXT,
-    params TEXT
-    );'''
-
     "%Y-%m-%d %H:%M:%S.%f %z"
 
-    DUMMY_USER_INSERT = "INSERT INTO api_users(username, email, password) VALUES('{}','{}','{}')".format("jsmith", "john.smith@gmail.com", "verySecure123")
+
     DUMMY_JOB_STARTIME = datetime.datetime.now(tz=datetime.timezone.utc) - datetime.timedelta(hours=2)
     DUMMY_JOB_ENDIME = datetime.datetime.now(tz=datetime.timezone.utc)
     DUMMY_JOB_INSERT = "INSERT INTO job_status(program, start_time,  params) VALUES('{}','{}','{}')".format(
@@ -90,14 +269,51 @@ if __name__ == '__main__':
     logging.info(f"Arguments: {args}")
     cfg = get_config(args.config)
     logging.info(f"Config: {cfg}")
+    scrypt_params = (cfg.get("PASSWORD_SCRYPT_N", 16384), cfg.get("PASSWORD_SCRYPT_R", 8), cfg.get("PASSWORD_SCRYPT_P", 1))
+    DUMMY_USER_INSERT = "INSERT INTO api_users(username, email, password) VALUES('{}','{}','{}')".format(
+        "jsmith", "john.smith@gmail.com", hash_password("verySecure123", *scrypt_params))
     # As DB HOST is the path to SQL Lite DB, need to create a relative path rather than hardcode the path into config file
     database_name = cfg["DB_URL"].split("//")[1]
     database_fullpath = os.path.join(os.path.dirname(__file__), database_name)
     dbh = DBHandler(cfg["DB_URL"], db_file_path=database_fullpath)
 
+    if args.migrate:
+        # Bring an existing database up to date. Every step is safe to re-run
+        for index_name, index_query in CREATE_JOB_STATUS_INDEX_QUERIES.items():
+            create_schema_object(dbh, index_query, index_name)
+        create_schema_object(dbh, CREATE_JOB_STATUS_CHANGES_TABLE_QUERY, "job_status_changes")
+        migrate_job_changes_changed_at(dbh)
+        for trigger_name, trigger_query in CREATE_JOB_STATUS_TRIGGER_QUERIES.items():
+            create_schema_object(dbh, trigger_query, trigger_name)
+        backfill_job_changes(dbh)
+        for index_name, index_query in CREATE_JOB_STATUS_CHANGES_INDEX_QUERIES.items():
+            create_schema_object(dbh, index_query, index_name)
+        migrate_job_times(dbh)
+        migrate_token_expiry(dbh)
+        migrate_passwords(dbh, *scrypt_params)
+        create_schema_object(dbh, CREATE_TOKEN_REVOCATIONS_TABLE_QUERY, "user_token_revocations")
+        for trigger_name, trigger_query in CREATE_TOKEN_JOURNAL_TRIGGER_QUERIES.items():
+            create_schema_object(dbh, trigger_query, trigger_name)
+        dedupe_user_tokens(dbh)
+        for index_name, index_query in CREATE_TOKEN_JOURNAL_INDEX_QUERIES.items():
+            create_schema_object(dbh, index_query, index_name)
+        sys.exit()
+
     create_table(dbh, CREATE_API_USERS_TABLE_QUERY, "api_users", args.drop)
     create_table(dbh, CREATE_TOKEN_JOURNAL_TABLE_QUERY, "user_token_journal", args.drop)
+    for index_name, index_query in CREATE_TOKEN_JOURNAL_INDEX_QUERIES.items():
+        create_schema_object(dbh, index_query, index_name)
+    create_table(dbh, CREATE_TOKEN_REVOCATIONS_TABLE_QUERY, "user_token_revocations", args.drop)
+    for trigger_name, trigger_query in CREATE_TOKEN_JOURNAL_TRIGGER_QUERIES.items():
+        create_schema_object(dbh, trigger_query, trigger_name)
     create_table(dbh, CREATE_JOB_STATUS_TABLE_QUERY, "job_status", args.drop)
+    create_table(dbh, CREATE_JOB_STATUS_CHANGES_TABLE_QUERY, "job_status_changes", args.drop)
+    for index_name, index_query in CREATE_JOB_STATUS_INDEX_QUERIES.items():
+        create_schema_object(dbh, index_query, index_name)
+    for index_name, index_query in CREATE_JOB_STATUS_CHANGES_INDEX_QUERIES.items():
+        create_schema_object(dbh, index_query, index_name)
+    for trigger_name, trigger_query in CREATE_JOB_STATUS_TRIGGER_QUERIES.items():
+        create_schema_object(dbh, trigger_query, trigger_name)
         
     insert_row(dbh, DUMMY_USER_INSERT)
     insert_row(dbh, DUMMY_JOB_INSERT)
@@ -0,0 +1,47 @@
+import asyncio, logging, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from .AuthHandler import (hash_password, verify_password, password_needs_rehash,
+                          DEFAULT_SCRYPT_N, DEFAULT_SCRYPT_R, DEFAULT_SCRYPT_P)
+
+
+# Async front for password hashing. scrypt is deliberately slow and holds the GIL, so hashing is done in a bounded
+# process pool and awaited by /login. A burst of logins queues up here instead of stalling every other request
+
+logger = logging.getLogger(__name__)
+
+class AsyncAuthHandler:
+
+    def __init__(self, max_workers:int=2, max_pending:int=100,
+                 n:int=DEFAULT_SCRYPT_N, r:int=DEFAULT_SCRYPT_R, p:int=DEFAULT_SCRYPT_P):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.n, self.r, self.p = n, r, p
+        # spawn rather than fork - the API process already runs threads (db executor), forking it is not safe
+        self.executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+        # Caps queued + running hashes. Further logins wait here instead of piling up in the executor queue
+        self._pending = asyncio.Semaphore(max_pending)
+        # Checked when a username does not exist, so unknown and known users take the same time to reject
+        self._dummy_hash = hash_password("dummy-password", n, r, p)
+        logger.info("Initiated AsyncAuthHandler (max_workers=%d, max_pending=%d, scrypt n=%d r=%d p=%d)", max_workers, max_pending, n, r, p)
+
+    async def _run(self, func, *args):
+        async with self._pending:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, func, *args)
+
+    async def hash_password(self, password:str) -> str:
+        return await self._run(hash_password, password, self.n, self.r, self.p)
+
+    async def verify_password(self, password:str, password_hash:str|None) -> bool:
+        if password_hash is None:
+            await self._run(verify_password, password, self._dummy_hash)
+            return False
+        return await self._run(verify_password, password, password_hash)
+
+    def needs_rehash(self, password_hash:str) -> bool:
+        return password_needs_rehash(password_hash, self.n, self.r, self.p)
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        logger.info("AsyncAuthHandler process pool shut down")
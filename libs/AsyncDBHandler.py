@@ -0,0 +1,63 @@
+import asyncio, contextvars, functools, logging, os
+from concurrent.futures import ThreadPoolExecutor
+
+from .DBHandler import DBHandler, TOKEN_REVOCATIONS, get_db_pool, get_token_cache
+from .MetricsHandler import DB_CALL_SECONDS
+
+
+# Async front for DBHandler. sqlite3 calls are blocking, so they are dispatched to a bounded thread pool
+# and awaited by the endpoints, leaving the event loop free to serve other requests while a query runs
+
+logger = logging.getLogger(__name__)
+
+class AsyncDBHandler:
+
+    def __init__(self, db_url:str="", max_workers:int=4, max_pending:int=200):
+        self.db_url = os.environ["DB_URL"] if db_url == "" else db_url
+        self.db_path = self.db_url.split("/")[-1]
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="dbhandler")
+        # Caps queued + running calls, further callers wait here instead of piling up in the executor queue
+        self._pending = asyncio.Semaphore(max_pending)
+        logger.info("Initiated AsyncDBHandler with '%s' (max_workers=%d, max_pending=%d)", self.db_url, max_workers, max_pending)
+
+    def _run_with_handler(self, func, args:tuple, kwargs:dict):
+        # Runs inside a worker thread. The connection is checked out of the pool and handed back within the same call
+        with DBHandler(self.db_url) as dbh:
+            return func(dbh, *args, **kwargs)
+
+    async def _dispatch(self, call_name:str, func, *args):
+        with DB_CALL_SECONDS.time(call=call_name):
+            async with self._pending:
+                loop = asyncio.get_running_loop()
+                # Runs in the caller's context, so log lines from the worker thread follow the request's log sampling
+                return await loop.run_in_executor(self.executor, functools.partial(contextvars.copy_context().run, func, *args))
+
+    async def run(self, func, *args, **kwargs):
+        # func receives a DBHandler as its first argument, i.e. await adbh.run(DBHandler.get_all_jobs)
+        return await self._dispatch(func.__name__, self._run_with_handler, func, args, kwargs)
+
+    def _read_data_version(self) -> int:
+        # Runs inside a worker thread, on the pool's watch connection - no pooled connection is checked out
+        pool = get_db_pool(self.db_path)
+        data_version = pool.data_version()
+        TOKEN_REVOCATIONS.sync(pool, data_version)
+        return data_version
+
+    async def data_version(self) -> int:
+        # Database wide change counter (see ConnectionPool.data_version()). Read once per request: it brings the token cache
+        # up to date with tokens revoked by any worker, and keys the response cache
+        return await self._dispatch("data_version", self._read_data_version)
+
+    async def check_token(self, token_str:str) -> tuple[bool, str]:
+        # Expects data_version() to have been read for this request. Cached tokens are answered without leaving the
+        # event loop, only a miss checks a connection out of the pool
+        if get_token_cache().get(token_str) is not None:
+            return True, ""
+        return await self.run(DBHandler.check_token_is_valid, token_str)
+
+    def shutdown(self) -> None:
+        # Let in-flight queries finish so their connections make it back to the pool before it is closed
+        self.executor.shutdown(wait=True)
+        logger.info("AsyncDBHandler executor shut down")
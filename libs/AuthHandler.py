@@ -1,9 +1,62 @@
-import secrets, logging
+import secrets, logging, base64
+
+from cryptography.exceptions import InvalidKey
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
 
 logger = logging.getLogger(__name__)
 
 # This module will handle creation of Auth related details as well as Eencryption requirements
-# i.e. encryption/decryption of passwords. 
+# i.e. encryption/decryption of passwords.
+
+# Passwords are stored as "scrypt$<n>$<r>$<p>$<salt>$<hash>" (base64 salt/hash). The work factors travel with the hash,
+# so raising them in config only affects new hashes and existing ones keep verifying (they are upgraded on next login)
+PASSWORD_HASH_SCHEME = "scrypt"
+DEFAULT_SCRYPT_N = 2 ** 14
+DEFAULT_SCRYPT_R = 8
+DEFAULT_SCRYPT_P = 1
+PASSWORD_SALT_BYTES = 16
+PASSWORD_HASH_BYTES = 32
+
+
+def _b64encode(raw:bytes) -> str:
+    return base64.b64encode(raw).decode("ascii")
+
+
+def hash_password(password:str, n:int=DEFAULT_SCRYPT_N, r:int=DEFAULT_SCRYPT_R, p:int=DEFAULT_SCRYPT_P) -> str:
+    # CPU (and n * r * 128 bytes of memory) heavy on purpose - run it through AsyncAuthHandler from the endpoints
+    salt = secrets.token_bytes(PASSWORD_SALT_BYTES)
+    derived_key = Scrypt(salt=salt, length=PASSWORD_HASH_BYTES, n=n, r=r, p=p).derive(password.encode("utf-8"))
+    return f"{PASSWORD_HASH_SCHEME}${n}${r}${p}${_b64encode(salt)}${_b64encode(derived_key)}"
+
+
+def _parse_password_hash(password_hash:str) -> tuple[int, int, int, bytes, bytes] | None:
+    try:
+        scheme, n, r, p, salt, derived_key = password_hash.split("$")
+        if scheme != PASSWORD_HASH_SCHEME:
+            return None
+        return int(n), int(r), int(p), base64.b64decode(salt), base64.b64decode(derived_key)
+    except (AttributeError, ValueError):
+        return None
+
+
+def verify_password(password:str, password_hash:str) -> bool:
+    parsed_hash = _parse_password_hash(password_hash)
+    if parsed_hash is None:
+        # Plaintext or unknown format. Run create_table_and_add_user.py --migrate to hash existing passwords
+        logger.error("Stored password is not a scrypt hash, unable to verify")
+        return False
+    n, r, p, salt, derived_key = parsed_hash
+    try:
+        Scrypt(salt=salt, length=len(derived_key), n=n, r=r, p=p).verify(password.encode("utf-8"), derived_key)
+        return True
+    except InvalidKey:
+        return False
+
+
+def password_needs_rehash(password_hash:str, n:int=DEFAULT_SCRYPT_N, r:int=DEFAULT_SCRYPT_R, p:int=DEFAULT_SCRYPT_P) -> bool:
+    parsed_hash = _parse_password_hash(password_hash)
+    return parsed_hash is None or parsed_hash[:3] != (n, r, p)
+
 
 class AuthHandler:
 
@@ -17,4 +70,4 @@ class AuthHandler:
         pass
 
     def get_token(self, token_size:int=16):
-        return secrets.token_hex(token_size)
\ No newline at end of file
+        return secrets.token_hex(token_size)
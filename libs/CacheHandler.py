@@ -0,0 +1,79 @@
+import threading, time, logging
+from collections import OrderedDict
+
+
+# Small in-process caches used to keep repeat lookups (i.e. the same bearer token on every poll) away from the database.
+# Caches are shared per name across the process, see get_cache()
+
+logger = logging.getLogger(__name__)
+
+class TTLCache:
+
+    def __init__(self, max_size:int=1024, ttl_seconds:float|None=60):
+        # ttl_seconds=None means entries only leave the cache through eviction/invalidation
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, key, default=None):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return value
+                del self._entries[key]
+            self._misses += 1
+            return default
+
+    def set(self, key, value, expires_at:float|None=None) -> None:
+        # expires_at (epoch seconds) lets the caller cap an entry below the cache wide ttl, never above it
+        if self.max_size <= 0:
+            return
+        if self.ttl_seconds is not None:
+            ttl_expiry = time.time() + self.ttl_seconds
+            expires_at = ttl_expiry if expires_at is None else min(expires_at, ttl_expiry)
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def invalidate(self, key) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"SIZE": len(self._entries), "MAX_SIZE": self.max_size, "HITS": self._hits,
+                    "MISSES": self._misses, "EVICTIONS": self._evictions}
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_cache(name:str, max_size:int=1024, ttl_seconds:float|None=60) -> TTLCache:
+    # Size/ttl only apply the first time a cache is requested, after that the existing cache is returned
+    with _caches_lock:
+        cache = _caches.get(name)
+        if cache is None:
+            cache = TTLCache(max_size, ttl_seconds)
+            _caches[name] = cache
+            logger.info("Created cache '%s' (max_size=%s, ttl_seconds=%s)", name, max_size, ttl_seconds)
+        return cache
+
+def get_cache_stats() -> dict:
+    with _caches_lock:
+        return {name: cache.stats() for name, cache in _caches.items()}
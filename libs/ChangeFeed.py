@@ -0,0 +1,68 @@
+import asyncio, logging
+
+
+# Wakes up long-poll / SSE clients of the job change feed.
+# A single background task watches the database's data_version for the whole process, every waiting client just awaits
+# an asyncio.Event, so an idle connection costs a parked coroutine and nothing on the database
+
+logger = logging.getLogger(__name__)
+
+class ChangeNotifier:
+
+    def __init__(self, db, poll_interval:float=0.5):
+        # db is the app's AsyncDBHandler
+        self.db = db
+        self.poll_interval = poll_interval
+        self._changed = asyncio.Event()
+        self._data_version = None
+        self._waiters = 0
+        self._task = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._watch())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _watch(self) -> None:
+        # Baseline so the first waiter is not woken up for changes made before it arrived
+        try:
+            self._data_version = await self.db.data_version()
+        except Exception as err:
+            logger.error("Change feed watcher failed to read data_version. '%s'", err)
+        while True:
+            # Nobody is waiting, nothing to check
+            if self._waiters > 0:
+                try:
+                    data_version = await self.db.data_version()
+                    if data_version != self._data_version:
+                        self._data_version = data_version
+                        self._notify()
+                except Exception as err:
+                    logger.error("Change feed watcher failed to read data_version. '%s'", err)
+            await asyncio.sleep(self.poll_interval)
+
+    def _notify(self) -> None:
+        # Wake everyone waiting on the current event and hand out a fresh one for the next change
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def listen(self) -> asyncio.Event:
+        # Grab the event *before* reading the journal, so a change landing between the read and the wait still wakes the caller
+        return self._changed
+
+    async def wait_for_change(self, changed:asyncio.Event, timeout:float) -> bool:
+        self._waiters += 1
+        try:
+            await asyncio.wait_for(changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._waiters -= 1
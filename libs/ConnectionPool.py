@@ -0,0 +1,227 @@
+import os, sqlite3, logging, threading, time
+from collections import OrderedDict
+
+from .CustomExceptions import InvalidInputError, ConnectionPoolError
+
+
+# Keeps a bounded set of long-lived sqlite3 connections that DBHandler() checks out and hands back.
+# One pool is shared per database file (see get_pool()) so every request in the process draws from the same connections
+
+logger = logging.getLogger(__name__)
+
+# PRAGMA values can't be bound as parameters, so only these are accepted from config
+JOURNAL_MODES = ("DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF")
+SYNCHRONOUS_MODES = ("OFF", "NORMAL", "FULL", "EXTRA")
+
+class ConnectionPool:
+
+    def __init__(self, db_path:str, pool_size:int=5, checkout_timeout:float=30.0, statement_cache_size:int=128,
+                 journal_mode:str="WAL", synchronous:str="NORMAL", busy_timeout_ms:int=5000):
+        if journal_mode.upper() not in JOURNAL_MODES:
+            raise InvalidInputError(f"Unsupported journal_mode: '{journal_mode}'. Expected one of {JOURNAL_MODES}")
+        if synchronous.upper() not in SYNCHRONOUS_MODES:
+            raise InvalidInputError(f"Unsupported synchronous mode: '{synchronous}'. Expected one of {SYNCHRONOUS_MODES}")
+        self.db_path = db_path
+        self.pool_size = pool_size
+        self.checkout_timeout = checkout_timeout
+        # Passed to sqlite3 as cached_statements - how many prepared statements each connection keeps for reuse
+        self.statement_cache_size = statement_cache_size
+        # WAL lets readers (in this and other API worker processes) carry on while /login writes a token,
+        # synchronous=NORMAL is durable in WAL mode apart from the last commits on power loss.
+        # busy_timeout is how long a writer waits on another process' write lock before 'database is locked'
+        self.journal_mode = journal_mode.upper()
+        self.synchronous = synchronous.upper()
+        self.busy_timeout_ms = busy_timeout_ms
+        # Idle connections are reused LIFO so the most recently used (warmest) connection goes out first
+        self._idle = []
+        self._condition = threading.Condition()
+        self._created = 0
+        self._in_use = 0
+        self._waiting = 0
+        self._closed = False
+        # Dedicated read-only connection used for PRAGMA data_version, see data_version()
+        self._watch_connection = None
+        self._watch_lock = threading.Lock()
+        # sqlite3 does not report statement cache hits, so the SQL text run on each pooled connection is tracked
+        # in an LRU of the same size. connection -> OrderedDict of statements, see track_statement()
+        self._statement_caches = {}
+        self._statement_lock = threading.Lock()
+        self._statement_hits = 0
+        self._statement_misses = 0
+
+    def _open(self) -> sqlite3.Connection:
+        # Connections move between threads (request handlers / executors), access is serialised by the pool itself
+        connection = sqlite3.connect(self.db_path, check_same_thread=False, cached_statements=self.statement_cache_size)
+        connection.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)};")
+        return connection
+
+    def _connect(self) -> sqlite3.Connection:
+        try:
+            connection = self._open()
+            # journal_mode is stored in the database file, every other connection picks it up from there
+            journal_mode = connection.execute(f"PRAGMA journal_mode = {self.journal_mode};").fetchone()[0]
+            if journal_mode.upper() != self.journal_mode:
+                logger.warning("Requested journal_mode %s for '%s', database is using %s", self.journal_mode, self.db_path, journal_mode)
+            connection.execute(f"PRAGMA synchronous = {self.synchronous};")
+        except sqlite3.Error as err:
+            raise InvalidInputError(f"Connection to 'sqlite3' failed. Unable to connect to database at '{self.db_path}'. '{err}'")
+        with self._condition:
+            self._created += 1
+        logger.info("Opened pooled connection #%d to '%s'", self._created, self.db_path)
+        return connection
+
+    def _is_healthy(self, connection:sqlite3.Connection) -> bool:
+        try:
+            connection.execute("SELECT 1;").fetchone()
+            return True
+        except sqlite3.Error as err:
+            logger.warning("Discarding unhealthy pooled connection to '%s'. '%s'", self.db_path, err)
+            return False
+
+    def acquire(self) -> sqlite3.Connection:
+        deadline = time.monotonic() + self.checkout_timeout
+        with self._condition:
+            if self._closed:
+                raise ConnectionPoolError(f"Connection pool for '{self.db_path}' is closed")
+            while not self._idle and self._in_use >= self.pool_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise ConnectionPoolError(f"Timed out after {self.checkout_timeout}s waiting for a connection to '{self.db_path}'")
+                self._waiting += 1
+                try:
+                    self._condition.wait(remaining)
+                finally:
+                    self._waiting -= 1
+            self._in_use += 1
+            connection = self._idle.pop() if self._idle else None
+
+        try:
+            if connection is not None and not self._is_healthy(connection):
+                self._forget_statements(connection)
+                connection.close()
+                connection = None
+            if connection is None:
+                connection = self._connect()
+        except Exception:
+            # Give the slot back, otherwise a failed connect permanently shrinks the pool
+            with self._condition:
+                self._in_use -= 1
+                self._condition.notify()
+            raise
+        return connection
+
+    def release(self, connection:sqlite3.Connection) -> None:
+        # Anything left uncommitted by the previous user must not leak into the next checkout
+        try:
+            if connection.in_transaction:
+                connection.rollback()
+        except sqlite3.Error as err:
+            logger.warning("Rollback on release failed, connection will be health checked on next checkout. '%s'", err)
+        with self._condition:
+            self._in_use -= 1
+            if self._closed:
+                self._forget_statements(connection)
+                connection.close()
+            else:
+                self._idle.append(connection)
+            self._condition.notify()
+
+    def track_statement(self, connection:sqlite3.Connection, sql_statement:str) -> bool:
+        # Mirrors sqlite3's per connection LRU (keyed on the exact SQL text) to count statement cache hits.
+        # Only statements with fixed text and bound values can hit, anything formatted into the SQL is a miss every time
+        if self.statement_cache_size <= 0:
+            return False
+        with self._statement_lock:
+            statements = self._statement_caches.setdefault(connection, OrderedDict())
+            hit = sql_statement in statements
+            if hit:
+                statements.move_to_end(sql_statement)
+                self._statement_hits += 1
+            else:
+                statements[sql_statement] = None
+                if len(statements) > self.statement_cache_size:
+                    statements.popitem(last=False)
+                self._statement_misses += 1
+            return hit
+
+    def _forget_statements(self, connection:sqlite3.Connection) -> None:
+        with self._statement_lock:
+            self._statement_caches.pop(connection, None)
+
+    def statement_cache_stats(self) -> dict:
+        with self._statement_lock:
+            lookups = self._statement_hits + self._statement_misses
+            return {"SIZE": self.statement_cache_size, "CACHED": sum(len(statements) for statements in self._statement_caches.values()),
+                    "HITS": self._statement_hits, "MISSES": self._statement_misses,
+                    "HIT_RATE": round(self._statement_hits / lookups, 4) if lookups else 0.0}
+
+    def data_version(self) -> int:
+        # PRAGMA data_version changes whenever *another* connection commits to the database (pooled connections
+        # in this process or writers in other processes). Because the watch connection never writes itself, its value
+        # works as a database wide change counter
+        return self.watch_query("PRAGMA data_version;")[0][0]
+
+    def watch_query(self, sql_statement:str, params:tuple=()) -> list:
+        # Small reads that run on every request (data_version, token revocations) go through the watch connection,
+        # so they never wait for or hold a pooled connection. Read only
+        with self._watch_lock:
+            if self._watch_connection is None:
+                # Not one of the pooled connections, so it is left out of CREATED and the pool size. It only reads,
+                # journal_mode / synchronous are the pooled (writing) connections' business
+                try:
+                    self._watch_connection = self._open()
+                except sqlite3.Error as err:
+                    raise InvalidInputError(f"Connection to 'sqlite3' failed. Unable to connect to database at '{self.db_path}'. '{err}'")
+                logger.info("Opened watch connection to '%s'", self.db_path)
+            return self._watch_connection.execute(sql_statement, params).fetchall()
+
+    def close(self) -> None:
+        with self._watch_lock:
+            if self._watch_connection is not None:
+                self._watch_connection.close()
+                self._watch_connection = None
+        with self._condition:
+            self._closed = True
+            for connection in self._idle:
+                self._forget_statements(connection)
+                connection.close()
+            self._idle = []
+            # Wake up anyone still waiting so they fail fast instead of hitting their timeout
+            self._condition.notify_all()
+        logger.info("Closed connection pool for '%s'. Stats: %s. Statement cache: %s", self.db_path, self.stats(), self.statement_cache_stats())
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {"SIZE": self.pool_size, "IN_USE": self._in_use, "IDLE": len(self._idle),
+                    "WAITING": self._waiting, "CREATED": self._created}
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(db_path:str, pool_size:int=5, checkout_timeout:float=30.0, statement_cache_size:int=128,
+             journal_mode:str="WAL", synchronous:str="NORMAL", busy_timeout_ms:int=5000) -> ConnectionPool:
+    # The existence check only happens once per database file, not once per request
+    with _pools_lock:
+        pool = _pools.get(db_path)
+        if pool is None or pool._closed:
+            if not os.path.exists(db_path):
+                raise InvalidInputError(f"Sqlite Database not found at: '{db_path}'")
+            pool = ConnectionPool(db_path, pool_size, checkout_timeout, statement_cache_size, journal_mode, synchronous, busy_timeout_ms)
+            _pools[db_path] = pool
+        return pool
+
+def get_pool_stats() -> dict:
+    with _pools_lock:
+        return {db_path: pool.stats() for db_path, pool in _pools.items()}
+
+def get_statement_cache_stats() -> dict:
+    with _pools_lock:
+        return {db_path: pool.statement_cache_stats() for db_path, pool in _pools.items()}
+
+def close_all_pools() -> None:
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
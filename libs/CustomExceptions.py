@@ -1,2 +1,5 @@
 class InvalidInputError(Exception):
-    pass
\ No newline at end of file
+    pass
+
+class ConnectionPoolError(Exception):
+    pass
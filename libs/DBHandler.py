@@ -1,8 +1,11 @@
 # Importing datetime all together rather than "from datetime import datetime" 
 # more readable in code, i.e. datetime.timezone rather than timezone
-import os, sqlite3, logging, os, datetime
+import os, sqlite3, logging, os, datetime, json, time, threading
 
 from .CustomExceptions import InvalidInputError
+from .ConnectionPool import ConnectionPool, get_pool
+from .CacheHandler import TTLCache, get_cache
+from .MetricsHandler import DB_QUERY_SECONDS, DB_QUERY_ROWS, DB_SLOW_QUERIES
 
 
 # This is the DatabaseHandler. All database querying/interactions shoudl go through this Class
@@ -10,18 +13,178 @@ from .CustomExceptions import InvalidInputError
 
 logger = logging.getLogger(__name__)
 
+# job_status start_time/end_time are stored as UTC text in this fixed width format, so comparing them as strings
+# orders them by time and the start_time index can be range scanned
+JOB_TIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f %z"
+
+def normalize_job_time(time_str:str|None) -> str|None:
+    # Accepts JOB_TIME_FORMAT or any ISO 8601 string. Naive values are taken as UTC
+    if time_str is None:
+        return None
+    try:
+        time_dt = datetime.datetime.strptime(time_str, JOB_TIME_FORMAT)
+    except ValueError:
+        try:
+            time_dt = datetime.datetime.fromisoformat(time_str)
+        except ValueError:
+            raise InvalidInputError(f"Unable to parse datetime: '{time_str}'")
+    if time_dt.tzinfo is None:
+        time_dt = time_dt.replace(tzinfo=datetime.timezone.utc)
+    try:
+        time_dt = time_dt.astimezone(datetime.timezone.utc)
+    except OverflowError:
+        raise InvalidInputError(f"Datetime out of range: '{time_str}'")
+    # strftime doesn't zero pad years below 1000, which would break the fixed width (string order = time order)
+    if not 1000 <= time_dt.year <= 9999:
+        raise InvalidInputError(f"Datetime out of range, the year must be between 1000 and 9999: '{time_str}'")
+    return time_dt.strftime(JOB_TIME_FORMAT)
+
+# Named statements run through execute_named_query(). The SQL text never changes and every value is bound,
+# so each statement is prepared once per pooled connection and then reused from sqlite3's statement cache
+# name -> (sql, statement_type)
+NAMED_QUERIES = {
+    "user_by_username": ("SELECT * FROM api_users WHERE username = ?;", "select"),
+    "update_user_password": ("UPDATE api_users SET password = ? WHERE user_id = ?;", "update"),
+    # Existence and expiry in one lookup on the UNIQUE token index. expiry is epoch seconds, bound value is the current time
+    "token_check": ("SELECT expiry, expiry > ? FROM user_token_journal WHERE token = ?;", "select"),
+    "token_by_user": ("SELECT token FROM user_token_journal WHERE user_id = ?;", "select"),
+    # Run on the pool's watch connection by TokenRevocations, not through execute_named_query()
+    "latest_token_revocation_id": ("SELECT COALESCE(MAX(revocation_id), 0) FROM user_token_revocations;", "select"),
+    "token_revocations_since": ('''SELECT revocation_id, token, expiry FROM user_token_revocations
+                                   WHERE revocation_id > ? ORDER BY revocation_id;''', "select"),
+    # One row per user (UNIQUE user_id index). A single statement, so two concurrent first logins can't both insert
+    "upsert_user_token": ('''INSERT INTO user_token_journal (user_id, token, expiry) VALUES (?, ?, ?)
+                             ON CONFLICT(user_id) DO UPDATE SET token = excluded.token, expiry = excluded.expiry;''', "insert"),
+    # Bounded so a large backlog of expired tokens is removed in short write transactions, see RetentionSweeper
+    "delete_expired_tokens": ('''DELETE FROM user_token_journal WHERE rowid IN
+                                 (SELECT rowid FROM user_token_journal WHERE expiry <= ? LIMIT ?);''', "delete"),
+    "delete_expired_token_revocations": ('''DELETE FROM user_token_revocations WHERE rowid IN
+                                            (SELECT rowid FROM user_token_revocations WHERE expiry <= ? LIMIT ?);''', "delete"),
+    "all_jobs": ("SELECT * FROM job_status;", "select"),
+    "job_by_id": ("SELECT * FROM job_status WHERE job_id = ?;", "select"),
+    # The ids are bound as a single JSON array and expanded by json_each(), so the batch size is not limited
+    # by SQLite's max number of bound variables
+    "jobs_by_ids": ("SELECT * FROM job_status WHERE job_id IN (SELECT value FROM json_each(?));", "select"),
+    # At most LIMIT journal rows after the cursor are read before grouping, so a page costs the same however far behind
+    # the client is. A job changed several times within the page comes back once, in its current state, ordered by its
+    # latest change. A page can therefore hold fewer jobs than the limit
+    "job_changes_since": ('''SELECT job_status.*, changes.change_id
+                             FROM (SELECT job_id, MAX(change_id) AS change_id
+                                   FROM (SELECT job_id, change_id FROM job_status_changes WHERE change_id > ? ORDER BY change_id LIMIT ?)
+                                   GROUP BY job_id) AS changes
+                             JOIN job_status ON job_status.job_id = changes.job_id
+                             ORDER BY changes.change_id;''', "select"),
+    "latest_change_id": ("SELECT MAX(change_id) FROM job_status_changes;", "select"),
+    # Lowest cursor the journal can still serve completely. Rows only leave the journal through the retention sweep
+    # and ids are never reused, so everything below the oldest row left (or the last id handed out, once empty) was pruned
+    "oldest_change_cursor": ('''SELECT COALESCE(MIN(change_id),
+                                                (SELECT seq + 1 FROM sqlite_sequence WHERE name = 'job_status_changes'), 1) - 1
+                                FROM job_status_changes;''', "select"),
+    # Bounded like delete_expired_tokens, see RetentionSweeper
+    "delete_old_job_changes": ('''DELETE FROM job_status_changes WHERE change_id IN
+                                  (SELECT change_id FROM job_status_changes WHERE changed_at < ? LIMIT ?);''', "delete"),
+    # program is UNIQUE, so it identifies the job being upserted. ?5/?6 flag whether end_time/params were sent,
+    # a field left out of the input keeps its stored value (an explicit null clears it). Rows that match what is stored
+    # are left alone, which keeps re-loads of the same file out of the change feed
+    "upsert_job": ('''INSERT INTO job_status(program, start_time, end_time, params) VALUES (?1, ?2, ?3, ?4)
+                      ON CONFLICT(program) DO UPDATE SET start_time = excluded.start_time,
+                                                         end_time = CASE WHEN ?5 THEN excluded.end_time ELSE end_time END,
+                                                         params = CASE WHEN ?6 THEN excluded.params ELSE params END
+                      WHERE start_time IS NOT excluded.start_time OR (?5 AND end_time IS NOT excluded.end_time)
+                            OR (?6 AND params IS NOT excluded.params);''', "insert"),
+}
+
+
+def get_db_pool(db_path:str) -> ConnectionPool:
+    # The process wide pool for db_path, sized from the environment (see app.py load_config())
+    return get_pool(db_path,
+                    pool_size=int(os.environ.get("DB_POOL_SIZE", 5)),
+                    checkout_timeout=float(os.environ.get("DB_POOL_TIMEOUT_SECONDS", 30)),
+                    statement_cache_size=int(os.environ.get("DB_STATEMENT_CACHE_SIZE", 128)),
+                    journal_mode=os.environ.get("DB_JOURNAL_MODE", "WAL"),
+                    synchronous=os.environ.get("DB_SYNCHRONOUS", "NORMAL"),
+                    busy_timeout_ms=int(os.environ.get("DB_BUSY_TIMEOUT_MS", 5000)))
+
+def get_token_cache() -> TTLCache:
+    # Valid tokens are cached per process so polling clients don't re-run the token queries on every request
+    return get_cache("tokens",
+                     max_size=int(os.environ.get("TOKEN_CACHE_SIZE", 10000)),
+                     ttl_seconds=float(os.environ.get("TOKEN_CACHE_TTL_SECONDS", 60)))
+
+def get_revoked_token_cache() -> TTLCache:
+    # Tokens revoked since this process started, kept until the token's own expiry. See DBHandler.check_token_is_valid()
+    return get_cache("revoked_tokens", max_size=int(os.environ.get("TOKEN_CACHE_SIZE", 10000)), ttl_seconds=None)
+
+
+class TokenRevocations:
+    # Keeps this process' token cache in step with the other API workers. Triggers on user_token_journal record every live
+    # token that is replaced (/login) or deleted in user_token_revocations. Whenever the data_version moves, the rows
+    # added since the last sync are read and just those tokens are dropped from the cache. Commits that don't touch
+    # tokens (job ingestion, sweeps) cost one keyed read and leave the cache alone
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data_version = None
+        self._revocation_id = None
+
+    def sync(self, pool:ConnectionPool, data_version:int) -> None:
+        with self._lock:
+            if data_version == self._data_version:
+                return
+            if self._revocation_id is None:
+                # The token cache starts out empty, only revocations from here on matter
+                self._revocation_id = pool.watch_query(NAMED_QUERIES["latest_token_revocation_id"][0])[0][0]
+            else:
+                token_cache, revoked_tokens = get_token_cache(), get_revoked_token_cache()
+                for revocation_id, token, expiry in pool.watch_query(NAMED_QUERIES["token_revocations_since"][0], (self._revocation_id,)):
+                    revoked_tokens.set(token, revocation_id, expires_at=expiry)
+                    token_cache.invalidate(token)
+                    self._revocation_id = revocation_id
+            self._data_version = data_version
+
+TOKEN_REVOCATIONS = TokenRevocations()
+
+
 class DBHandler:
 
 
     def __init__(self, db_url:str="", db_file_path:str=""):
         self.db_url = os.environ["DB_URL"] if db_url == "" else db_url
-        logger.info(f"Initiated DBHandler with '{self.db_url}'")
+        # One per request - debug only
+        logger.debug("Initiated DBHandler with '%s'", self.db_url)
         self.db_type = self.db_url.split(":")[0] 
         self.db_path = self.db_url.split("/")[-1] if db_file_path == "" else db_file_path
-        # Before instatiating a DB Object, verify it can connect
+        self.pool = None
+        # 0 turns the slow query log off
+        self.slow_query_threshold_seconds = float(os.environ.get("SLOW_QUERY_THRESHOLD_MS", 0)) / 1000
+        self.token_cache = get_token_cache()
+        self.revoked_tokens = get_revoked_token_cache()
+        # Short lived cache of user records so login bursts don't hit the database once per attempt
+        self.user_cache = get_cache("users",
+                                    max_size=int(os.environ.get("USER_CACHE_SIZE", 1000)),
+                                    ttl_seconds=float(os.environ.get("USER_CACHE_TTL_SECONDS", 30)))
+        # Before instatiating a DB Object, verify it can connect (connection is checked out of the shared pool)
         self.connection = self._test_connection()
         self.client = self.connection.cursor()
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def __del__(self):
+        # Safety net for handlers that were never closed, so the connection still makes it back to the pool
+        self.close()
+
+    def close(self) -> None:
+        # Hand the connection back to the pool. Safe to call more than once
+        if getattr(self, "pool", None) is not None and getattr(self, "connection", None) is not None:
+            self.client.close()
+            self.pool.release(self.connection)
+            self.connection = None
+            self.client = None
+
     def _retrieve_decrypted_password(p:str):
         # This is not needed for Sqlite3 example. If you were to store DB password in file, you will likely encrypt it. 
         # This is where you would implement logic on how to decrypt it
@@ -30,19 +193,15 @@ class DBHandler:
     def _test_connection(self) -> None:
         match self.db_type:
             case "sqlite3":
-                if os.path.exists(self.db_path):
-                    try:
-                        return sqlite3.connect(self.db_path)
-                    except:
-                        raise InvalidInputError(f"Connection to '{self.db_type}' failed. Unable to connect to database at '{self.db_path}'")
-                else:
-                    raise InvalidInputError(f"Sqlite Database not found at: '{self.db_path}'")
+                self.pool = get_db_pool(self.db_path)
+                return self.pool.acquire()
             case _:
                 raise InvalidInputError(f"Unimplemented database type: '{self.db_type}'")
         pass
     
-    def _execute_select(self, select_statement:str, include_headers:bool=False) -> dict:
-        self.client.execute(select_statement)
+    def _execute_select(self, select_statement:str, include_headers:bool=False, params:tuple|dict=()) -> dict:
+        self.pool.track_statement(self.connection, select_statement)
+        self.client.execute(select_statement, params)
         rows = self.client.fetchall()
         if len(rows) > 0:
             # Add headers if the flag is present, otherwise give them rows as produced by sqlite3 module
@@ -53,121 +212,228 @@ class DBHandler:
         else:
             return {"STATUS": False, "ROWS": [], "STATEMENT": select_statement}
     
-    def _execute_crud(self, crud_sql_statement:str, commit_flag:bool=False) -> dict:
-        self.client.execute(crud_sql_statement)
+    def _execute_crud(self, crud_sql_statement:str, commit_flag:bool=False, params:tuple|dict=()) -> dict:
+        self.pool.track_statement(self.connection, crud_sql_statement)
+        self.client.execute(crud_sql_statement, params)
         impacted_rows = self.client.rowcount
         if impacted_rows > 0:
             if commit_flag:
                 self.connection.commit()
-                logging.warning(f"Transaction has been committed '{crud_sql_statement}'")
+                logger.info("Transaction has been committed '%s'", crud_sql_statement)
             return {"STATUS": True, "ROWS": [impacted_rows], "STATEMENT": crud_sql_statement}
         else:
             return {"STATUS": False, "ROWS": [impacted_rows], "STATEMENT": crud_sql_statement}
 
-    def execute_query(self, sql_statement:str, statement_type:str="select", include_headers:bool=False, commit_flag:bool=False) -> str:
+    def execute_query(self, sql_statement:str, statement_type:str="select", include_headers:bool=False, commit_flag:bool=False,
+                      params:tuple|dict=()) -> str:
+        # params are bound by sqlite3 (? or :name placeholders) rather than formatted into the statement
+        started = time.perf_counter()
         match statement_type.lower():
             case "select":
-                response = self._execute_select(sql_statement, include_headers)
+                response = self._execute_select(sql_statement, include_headers, params)
             case "update" | "delete" | "insert":
                 # C.R.U.D. => Create / Replace / Update / Delete
-                response =  self._execute_crud(sql_statement, commit_flag)
+                response =  self._execute_crud(sql_statement, commit_flag, params)
             case "create":
                 try:
                     self.client.execute(sql_statement)
                     response = {"STATUS":True}
                 except sqlite3.OperationalError as err:
-                    logging.error(f"Unable to run CREATE statement. '{sql_statement}'. Exception below: '{err}'")
-                    {"STATUS":False}
+                    logger.error("Unable to run CREATE statement. '%s'. Exception below: '%s'", sql_statement, err)
+                    response = {"STATUS":False}
             case _:
-                logger.error(f"execute_query() - Failed to execute '{sql_statement}'")
+                logger.error("execute_query() - Failed to execute '%s'", sql_statement)
                 raise InvalidInputError(f"Unable to action based on statement type: '{statement_type}'")
-        
+        self._record_query(statement_type.lower(), sql_statement, time.perf_counter() - started, response, include_headers)
+
         return response
 
-    def retrieve_user_details(self, username:str) -> dict:
-        query_result = self.execute_query(f"Select * from api_users;")
-        return query_result
+    def execute_named_query(self, query_name:str, params:tuple|dict=(), include_headers:bool=False, commit_flag:bool=False) -> dict:
+        if query_name not in NAMED_QUERIES:
+            raise InvalidInputError(f"Unknown named query: '{query_name}'")
+        sql_statement, statement_type = NAMED_QUERIES[query_name]
+        return self.execute_query(sql_statement, statement_type, include_headers=include_headers, commit_flag=commit_flag, params=params)
 
-    def _is_valid_token(self, token_str:str) -> bool:
-        token_exists_sql = f"SELECT 1 FROM user_token_journal WHERE token = '{token_str}';"
-        token_exists_response = self.execute_query(token_exists_sql, "select")
-        return token_exists_response["STATUS"]
+    def _record_query(self, statement_type:str, sql_statement:str, duration:float, response:dict, include_headers:bool) -> None:
+        # Feeds /metrics and the optional slow query log. Bound values are never logged, they include tokens and password hashes
+        match statement_type:
+            case "select":
+                row_count = max(len(response["ROWS"]) - (1 if include_headers and response["STATUS"] else 0), 0)
+            case "update" | "delete" | "insert":
+                row_count = response["ROWS"][0]
+            case _:
+                row_count = 0
+        DB_QUERY_SECONDS.observe(duration, type=statement_type)
+        DB_QUERY_ROWS.observe(row_count, type=statement_type)
+        if self.slow_query_threshold_seconds > 0 and duration >= self.slow_query_threshold_seconds:
+            DB_SLOW_QUERIES.inc(type=statement_type)
+            logger.warning("Slow query (%.1f ms, %d rows): '%s'", duration * 1000, row_count, sql_statement)
 
-    def _token_expiry_check(self, token_str:str) -> (bool, str):
-        # Get the token's expiry from database
-        get_token_expiry_sql = f"SELECT expiry FROM user_token_journal WHERE token = '{token_str}';"
-        get_token_expiry_result = self.execute_query(get_token_expiry_sql, "select")
-        expiry_str = get_token_expiry_result["ROWS"][0][0]
-        expiry_time_dt = self._convert_expiry_to_datetime(expiry_str)
-        # Get Current time
-        current_time_dt = self._get_current_datetime()
-        # Check it against current time and return result
-        return expiry_time_dt < current_time_dt, expiry_str
+    def retrieve_user_details(self, username:str) -> dict:
+        # Keyed lookup on the UNIQUE username index, returns at most one row
+        cached_result = self.user_cache.get(username)
+        if cached_result is not None:
+            return cached_result
+        query_result = self.execute_named_query("user_by_username", (username,))
+        if query_result["STATUS"]:
+            self.user_cache.set(username, query_result)
+        return query_result
 
+    def update_user_password(self, user_id:int, username:str, password_hash:str) -> dict:
+        # password_hash comes from AuthHandler.hash_password(), plaintext passwords are never stored
+        update_result = self.execute_named_query("update_user_password", (password_hash, user_id), commit_flag=True)
+        self.user_cache.invalidate(username)
+        return update_result
 
     def check_token_is_valid(self, token_str:str) -> bool:
-        checks_failed = 0
-        msg = ""
+        # Only valid tokens are cached, and never beyond their own expiry. Replaced tokens are dropped from the cache
+        # by TokenRevocations.sync(), which runs on every request's data_version read (AsyncDBHandler.data_version())
+        if self.token_cache.get(token_str) is not None:
+            return True, ""
+        token_check_result = self.execute_named_query("token_check", (int(time.time()), token_str))
         # 1 Token is not a valid token. REJECT
-        if not self._is_valid_token(token_str):
-            logging.warning(f"Token '{token_str}' was not found in database")
-            checks_failed += 1
-            msg = "Not a valid token"
-        else:
-            # 2 Token has expired and no longer valid. REJECT
-            # If the token was valid, we need to check if it has expired
-            expired, expiry_date = self._token_expiry_check(token_str)
-            if expired:
-                logging.warning(f"Token '{token_str}' has expired. Expiry Date: {expiry_date}")
-                msg = f"Expired on: {expiry_date}"
-                checks_failed +=1
-        result = True if checks_failed == 0 else False
-        return result, msg
+        if not token_check_result["STATUS"]:
+            logger.warning("Token '%s' was not found in database", token_str)
+            return False, "Not a valid token"
+        # 2 Token has expired and no longer valid. REJECT
+        expiry, not_expired = token_check_result["ROWS"][0]
+        if not not_expired:
+            logger.warning("Token '%s' has expired. Expiry Date: %s", token_str, self._format_expiry(expiry))
+            return False, f"Expired on: {self._format_expiry(expiry)}"
+        self.token_cache.set(token_str, expiry, expires_at=expiry)
+        # Revoked while this check ran - read before the replacing commit, but cached after the revocation was synced
+        if self.revoked_tokens.get(token_str) is not None:
+            self.token_cache.invalidate(token_str)
+        return True, ""
 
     def _get_current_datetime(self, tz:datetime.timezone=datetime.timezone.utc,
                                forward_offset:int=0) -> datetime:
         # This might get more complicated if there are other timezones to consider
         return datetime.datetime.now(tz) + datetime.timedelta(hours=forward_offset)
 
-    def _convert_expiry_to_datetime(self, datetime_str:str, datetime_str_format:str="%Y-%m-%d %H:%M:%S.%f %z") -> datetime.datetime:
-        return datetime.datetime.strptime(datetime_str, datetime_str_format)
+    def _new_token_expiry(self) -> int:
+        # Token expiry is stored as epoch seconds (UTC), compared as a plain integer by the token check and the sweeper
+        return int(self._get_current_datetime(forward_offset=int(os.environ["API_TOKEN_HOURS_LIFETIME"])).timestamp())
+
+    def _format_expiry(self, expiry:int) -> str:
+        return datetime.datetime.fromtimestamp(expiry, datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S %z")
 
     def register_new_token(self, token_str:str, user_id:int) -> dict:
-        # Check if User already has a token. If so, update the record
-        user_has_token_flag = self.get_user_for_token(user_id)
-        if user_has_token_flag:
-            # NOTE: these 3 lines could be broken into a separate function in case there are other situations that require updating a token (more reusable)
-            new_expiry_datetime_str = self._get_current_datetime(forward_offset=int(os.environ["API_TOKEN_HOURS_LIFETIME"])
-                                                                 ).strftime("%Y-%m-%d %H:%M:%S.%f %z")
-            update_users_token_entry_sql = f"UPDATE user_token_journal SET token='{token_str}', expiry='{new_expiry_datetime_str}' WHERE user_id = {user_id};"
-            response =  self.execute_query(update_users_token_entry_sql, "update", commit_flag=True)
-            logging.info(f"Updated token for User #{user_id} - Expiry Time (UTC): {new_expiry_datetime_str}")
-        # If user does not have token, then insert the token into user_token_journal table
-        elif not user_has_token_flag:
-            new_expiry_datetime_str = self._get_current_datetime(forward_offset=int(os.environ["API_TOKEN_HOURS_LIFETIME"])
-                                                                 ).strftime("%Y-%m-%d %H:%M:%S.%f %z")
-            insert_new_user_token_sql = f"INSERT INTO user_token_journal (user_id, token, expiry) VALUES ({user_id}, '{token_str}', '{new_expiry_datetime_str}');"
-            response =  self.execute_query(insert_new_user_token_sql, "insert", commit_flag=True)
-            logging.info(f"First User Token Generated for User #{user_id}. - Expiry Time (UTC): {new_expiry_datetime_str}")
+        # Inserts the user's first token or replaces the one they have, in one statement.
+        # BEGIN IMMEDIATE takes the write lock before the previous token is read, so it is the exact token the upsert replaces
+        new_expiry = self._new_token_expiry()
+        self.client.execute("BEGIN IMMEDIATE;")
+        try:
+            previous_token = self.get_token_for_user(user_id)
+            response = self.execute_named_query("upsert_user_token", (user_id, token_str, new_expiry))
+            self.connection.commit()
+        except sqlite3.Error:
+            self.connection.rollback()
+            raise
+        # Only once the new token has committed. Dropped any earlier, a concurrent check could still read the old token
+        # from the database and put it back in the cache
+        if previous_token:
+            self.token_cache.invalidate(previous_token)
+        if response["STATUS"]:
+            logger.info("Registered token for User #%s - Expiry Time (UTC): %s", user_id, self._format_expiry(new_expiry))
         else:
-            logger.error("Unable to register new token . Token_string: '{}' and User ID: '{}' received")
-            response =  {"STATUS": False}
-        
+            logger.error("Unable to register new token for User ID: '%s'", user_id)
         return response
 
-    def get_user_for_token(self, user_id:int) -> int | bool:
-        check_user_id_sql = f"SELECT user_id FROM user_token_journal WHERE user_id = {user_id};"
-        result = self.execute_query(check_user_id_sql, "select")
-        if result["STATUS"]:
-            # expected "result" object is  {...., "ROWS": [[<user_id/int>],....}
-            return result["ROWS"][0][0]
-        elif not result["STATUS"]:
-            return False
+    def get_token_for_user(self, user_id:int) -> str | bool:
+        result = self.execute_named_query("token_by_user", (user_id,))
+        return result["ROWS"][0][0] if result["STATUS"] else False
+
+    def delete_expired_tokens(self, batch_size:int=1000) -> int:
+        # Removes up to batch_size expired tokens and returns how many went
+        delete_result = self.execute_named_query("delete_expired_tokens", (int(time.time()), batch_size), commit_flag=True)
+        return delete_result["ROWS"][0]
 
     def get_all_jobs(self) -> dict:
-        get_all_jobs_sql = "SELECT * FROM  job_status;"
-        return self.execute_query(get_all_jobs_sql, include_headers=True)
+        return self.execute_named_query("all_jobs", include_headers=True)
     
+    def _build_job_filters(self, running:bool|None=None, program:str|None=None,
+                           started_after:str|None=None, started_before:str|None=None) -> tuple[list[str], list]:
+        # Each filter maps onto an index created by create_table_and_add_user.py:
+        # running -> partial index on end_time IS NULL, program -> UNIQUE index, started_* -> start_time index
+        conditions, params = [], []
+        if running is not None:
+            conditions.append("end_time IS NULL" if running else "end_time IS NOT NULL")
+        if program is not None:
+            conditions.append("program = ?")
+            params.append(program)
+        if started_after is not None:
+            conditions.append("start_time >= ?")
+            params.append(normalize_job_time(started_after))
+        if started_before is not None:
+            conditions.append("start_time < ?")
+            params.append(normalize_job_time(started_before))
+        return conditions, params
+
+    def get_filtered_jobs(self, **filters) -> dict:
+        conditions, params = self._build_job_filters(**filters)
+        where_clause = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        get_filtered_jobs_sql = f"SELECT * FROM job_status{where_clause} ORDER BY job_id;"
+        return self.execute_query(get_filtered_jobs_sql, include_headers=True, params=tuple(params))
+
+    def get_jobs_page(self, after_job_id:int=0, limit:int=500, **filters) -> dict:
+        # Keyset pagination - seeks straight to job_id > after_job_id on the primary key instead of OFFSET scanning
+        conditions, params = self._build_job_filters(**filters)
+        get_jobs_page_sql = "SELECT * FROM job_status WHERE " + " AND ".join(["job_id > ?"] + conditions) + " ORDER BY job_id LIMIT ?;"
+        return self.execute_query(get_jobs_page_sql, include_headers=True, params=tuple([after_job_id] + params + [limit]))
+
     def get_job_by_id(self, job_id:str) -> dict:
-        get_all_jobs_sql = f"SELECT * FROM  job_status WHERE job_id = {job_id}"
-        return self.execute_query(get_all_jobs_sql, include_headers=True)
\ No newline at end of file
+        return self.execute_named_query("job_by_id", (job_id,), include_headers=True)
+
+    def get_jobs_by_ids(self, job_ids:list[int]) -> dict:
+        # One query for the whole batch
+        return self.execute_named_query("jobs_by_ids", (json.dumps(job_ids),), include_headers=True)
+
+    def upsert_jobs(self, job_rows:list[tuple]) -> dict:
+        # One executemany() and one commit for the whole batch. If the batch fails it is replayed row by row,
+        # so only the offending rows are rejected. FAILED maps the row's index in job_rows to the error
+        upsert_job_sql, statement_type = NAMED_QUERIES["upsert_job"]
+        started = time.perf_counter()
+        self.pool.track_statement(self.connection, upsert_job_sql)
+        failed_rows = {}
+        try:
+            self.client.executemany(upsert_job_sql, job_rows)
+            changed_rows = self.client.rowcount
+            self.connection.commit()
+        except sqlite3.Error as err:
+            self.connection.rollback()
+            logger.warning("Batch of %d job upserts failed, retrying row by row. '%s'", len(job_rows), err)
+            changed_rows = 0
+            for idx, job_row in enumerate(job_rows):
+                try:
+                    self.client.execute(upsert_job_sql, job_row)
+                    changed_rows += self.client.rowcount
+                except sqlite3.Error as row_err:
+                    failed_rows[idx] = str(row_err)
+            self.connection.commit()
+        response = {"STATUS": len(failed_rows) < len(job_rows), "ROWS": [changed_rows], "FAILED": failed_rows, "STATEMENT": upsert_job_sql}
+        self._record_query(statement_type, upsert_job_sql, time.perf_counter() - started, response, False)
+        return response
+
+    def get_job_changes(self, since_change_id:int, limit:int=500) -> dict:
+        # Reads the job_status_changes journal (filled by triggers on job_status) incrementally from a client cursor
+        return self.execute_named_query("job_changes_since", (since_change_id, limit), include_headers=True)
+
+    def get_latest_change_id(self) -> int:
+        latest_change_result = self.execute_named_query("latest_change_id")
+        return latest_change_result["ROWS"][0][0] or 0
+
+    def delete_expired_token_revocations(self, batch_size:int=1000) -> int:
+        # Revocations only matter until the revoked token would have expired anyway
+        delete_result = self.execute_named_query("delete_expired_token_revocations", (int(time.time()), batch_size), commit_flag=True)
+        return delete_result["ROWS"][0]
+
+    def get_oldest_change_cursor(self) -> int:
+        # A client cursor below this has missed changes that were pruned, see delete_old_job_changes()
+        return self.execute_named_query("oldest_change_cursor")["ROWS"][0][0]
+
+    def delete_old_job_changes(self, retention_seconds:float, batch_size:int=1000) -> int:
+        # Removes up to batch_size journal rows older than retention_seconds and returns how many went
+        delete_result = self.execute_named_query("delete_old_job_changes", (int(time.time() - retention_seconds), batch_size),
+                                                 commit_flag=True)
+        return delete_result["ROWS"][0]
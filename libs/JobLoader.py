@@ -0,0 +1,87 @@
+import csv, json, logging
+
+from .CustomExceptions import InvalidInputError
+from .DBHandler import DBHandler, normalize_job_time
+
+
+# Bulk loading of job_status rows, shared by POST /jobs/ingest (NDJSON) and load_jobs.py (JSONL/CSV).
+# Readers yield (line number, row dict or None, parse error) so every bad line can be reported back with its position,
+# load_jobs() validates the rows and upserts them in batches through DBHandler.upsert_jobs()
+
+logger = logging.getLogger(__name__)
+
+JOB_FIELDS = ("program", "start_time", "end_time", "params")
+
+
+def read_jobs_ndjson(lines) -> iter:
+    for line_no, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield line_no, json.loads(line), None
+        except json.JSONDecodeError as err:
+            yield line_no, None, f"Invalid JSON. '{err}'"
+
+
+def read_jobs_csv(csv_file) -> iter:
+    # Header row names the columns. Empty cells are loaded as NULL, columns missing from the header keep their stored values
+    reader = csv.DictReader(csv_file)
+    for row in reader:
+        if None in row:
+            yield reader.line_num, None, f"Expected {len(reader.fieldnames)} columns, received {len(reader.fieldnames) + len(row[None])}"
+            continue
+        yield reader.line_num, {key: (value if value != "" else None) for key, value in row.items()}, None
+
+
+def prepare_job_row(job_row:dict) -> tuple:
+    # Validates one job and returns it as upsert_job parameters (program, start_time, end_time, params, end_time sent, params sent).
+    # A job that leaves out end_time/params keeps the stored values, so a feed of status updates doesn't have to repeat them
+    if not isinstance(job_row, dict):
+        raise InvalidInputError("Expected a JSON object")
+    unknown_fields = set(job_row) - set(JOB_FIELDS)
+    if unknown_fields:
+        raise InvalidInputError(f"Unknown field(s): {sorted(unknown_fields)}")
+    program = job_row.get("program")
+    if not isinstance(program, str) or program.strip() == "":
+        raise InvalidInputError("'program' is required")
+    for field_name in ("start_time", "end_time", "params"):
+        if job_row.get(field_name) is not None and not isinstance(job_row[field_name], str):
+            raise InvalidInputError(f"'{field_name}' must be a string or null")
+    if job_row.get("start_time") is None:
+        raise InvalidInputError("'start_time' is required")
+    return (program, normalize_job_time(job_row["start_time"]), normalize_job_time(job_row.get("end_time")), job_row.get("params"),
+            "end_time" in job_row, "params" in job_row)
+
+
+def load_jobs(dbh:DBHandler, job_records, batch_size:int=1000) -> dict:
+    # job_records comes from one of the read_jobs_* readers. Runs on a DBHandler thread (AsyncDBHandler.run) or from the CLI
+    report = {"received": 0, "changed": 0, "unchanged": 0, "failed": 0, "errors": []}
+
+    def flush(batch:list[tuple[int, tuple]]) -> None:
+        upsert_result = dbh.upsert_jobs([job_row for _, job_row in batch])
+        for idx, error in upsert_result["FAILED"].items():
+            report["errors"].append({"line": batch[idx][0], "error": error})
+        report["failed"] += len(upsert_result["FAILED"])
+        report["changed"] += upsert_result["ROWS"][0]
+        report["unchanged"] += len(batch) - len(upsert_result["FAILED"]) - upsert_result["ROWS"][0]
+
+    batch = []
+    for line_no, job_row, parse_error in job_records:
+        report["received"] += 1
+        try:
+            if parse_error is not None:
+                raise InvalidInputError(parse_error)
+            batch.append((line_no, prepare_job_row(job_row)))
+        except InvalidInputError as err:
+            report["failed"] += 1
+            report["errors"].append({"line": line_no, "error": str(err)})
+            continue
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+    report["errors"].sort(key=lambda error: error["line"])
+    logger.info("Loaded jobs - received %d, changed %d, unchanged %d, failed %d",
+                report["received"], report["changed"], report["unchanged"], report["failed"])
+    return report
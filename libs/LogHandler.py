@@ -0,0 +1,109 @@
+import atexit, contextvars, logging, logging.handlers, os, queue, random, threading
+
+
+# Logging for the API process. Request handlers only put records on an in-memory queue, a background thread
+# (QueueListener) formats them and writes them to a size rotated log file, so no request waits on file I/O.
+# Routine INFO lines can be sampled per endpoint (LOG_SAMPLE_RATES), warnings and errors are always kept
+
+LOG_FORMAT = "%(asctime)s - %(process)d - %(name)s:%(funcName)s:%(lineno)d - %(levelname)s - %(message)s"
+
+# Set by LogContextMiddleware for the duration of a request, see RequestLogContext
+_request_log_context = contextvars.ContextVar("request_log_context", default=None)
+
+_listener = None
+_listener_lock = threading.Lock()
+
+
+class RequestLogContext:
+    # Whether the current request's INFO lines are kept is decided once, on its first INFO line, so a request is logged
+    # either completely or not at all. By then routing has run and the route template is in the scope
+
+    def __init__(self, scope:dict, sample_rates:dict):
+        self.scope = scope
+        self.sample_rates = sample_rates
+        self._sampled = None
+
+    def sampled(self) -> bool:
+        if self._sampled is None:
+            route_path = getattr(self.scope.get("route"), "path", None)
+            sample_rate = self.sample_rates.get(route_path, self.sample_rates.get("default", 1.0))
+            self._sampled = sample_rate >= 1.0 or random.random() < sample_rate
+        return self._sampled
+
+
+class RequestSamplingFilter(logging.Filter):
+    # Runs on the request's own thread before the record is queued, so dropped lines cost next to nothing
+
+    def filter(self, record:logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO:
+            return True
+        request_log_context = _request_log_context.get()
+        return request_log_context is None or request_log_context.sampled()
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    # A full queue means the writer thread can't keep up. Dropping the record is better than blocking the request
+
+    def __init__(self, log_queue:queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record:logging.LogRecord) -> logging.LogRecord:
+        # The stock QueueHandler formats the message here, on the caller's thread. The queue never leaves this process,
+        # so the record is passed on as is and the writer thread does the formatting
+        return record
+
+    def enqueue(self, record:logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogContextMiddleware:
+    # Plain ASGI middleware, tags every log line written while serving a request with that request's sampling decision
+
+    def __init__(self, app, sample_rates:dict|None=None):
+        self.app = app
+        self.sample_rates = sample_rates or {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.sample_rates:
+            return await self.app(scope, receive, send)
+        context_token = _request_log_context.set(RequestLogContext(scope, self.sample_rates))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _request_log_context.reset(context_token)
+
+
+def configure_logging(log_file:str="app.log", level:str="INFO", max_bytes:int=10 * 1024 * 1024, backup_count:int=5,
+                      queue_size:int=10000) -> logging.handlers.QueueListener:
+    # Safe to call more than once per process, only the first call sets things up.
+    # "{pid}" in log_file gives every worker its own file - RotatingFileHandler can't rotate a file shared between processes
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            return _listener
+        log_file = log_file.format(pid=os.getpid())
+        if os.path.dirname(log_file):
+            os.makedirs(os.path.dirname(log_file), exist_ok=True)
+        file_handler = logging.handlers.RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+        file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+        log_queue = queue.Queue(maxsize=queue_size)
+        queue_handler = DroppingQueueHandler(log_queue)
+        queue_handler.addFilter(RequestSamplingFilter())
+        root_logger = logging.getLogger()
+        root_logger.setLevel(level.upper())
+        root_logger.addHandler(queue_handler)
+
+        _listener = logging.handlers.QueueListener(log_queue, file_handler, respect_handler_level=True)
+        _listener.start()
+        # Flush whatever is still queued when the process exits
+        atexit.register(_listener.stop)
+        return _listener
+
+
+def get_dropped_log_records() -> int:
+    return sum(handler.dropped for handler in logging.getLogger().handlers if isinstance(handler, DroppingQueueHandler))
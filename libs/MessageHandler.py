@@ -1,4 +1,6 @@
-import logging, re
+import logging, re, json
+
+from .MetricsHandler import SERIALIZATION_SECONDS
 
 logger = logging.getLogger(__name__)
 
@@ -23,8 +25,22 @@ class RequestHandler(MessageHandler):
     # Verify the keys are there, do some processing/extraction of data
 
     def verify_login_request(self, request_json:dict) -> bool:
-        logger.info(f"Received a request string '{request_json}'")
-        return self._required_keys(request_json, "username", "password")
+        # Only the keys - the values include the password
+        logger.debug("Received a login request with keys %s", list(request_json) if isinstance(request_json, dict) else None)
+        if not isinstance(request_json, dict) or not self._required_keys(request_json, "username", "password"):
+            return False
+        # Checked here, before the password is sent to the hashing process pool, which only accepts strings
+        return isinstance(request_json["username"], str) and isinstance(request_json["password"], str)
+
+    def verify_jobs_lookup_request(self, request_json:dict, max_job_ids:int) -> tuple[bool,str]:
+        if not isinstance(request_json, dict) or not self._required_keys(request_json, "job_ids"):
+            return (False, "Missing 'job_ids' key")
+        job_ids = request_json["job_ids"]
+        if not isinstance(job_ids, list) or not all(type(job_id) is int for job_id in job_ids):
+            return (False, "'job_ids' must be a list of integers")
+        if len(job_ids) > max_job_ids:
+            return (False, f"Too many job_ids. Received {len(job_ids)}, the maximum is {max_job_ids}")
+        return (True, "")
 
     def check_token_is_present(self, request:dict) -> tuple[bool,str]:
         if self._required_keys(request.headers, "authorization"):
@@ -39,10 +55,10 @@ class RequestHandler(MessageHandler):
             if search_result:
                 return (True, search_result.group(1))
             else:
-                logging.warning(f"Unable to parse token from Authorization value: '{auth_str}'")
+                logger.warning("Unable to parse token from Authorization value")
                 return (False, "Token not found")
         else:
-            logging.warning(f"Not a valid Authorization Value: '{auth_str}'")
+            logger.warning("Not a valid Authorization Value")
             return False,"Not a valid Authorization Value (missing 'Bearer ')"
 
 
@@ -50,16 +66,53 @@ class ResponseHandler(MessageHandler):
     # Class for handling Responses that are fed to client
     # Convert DBHandler Objects and other Python objects into Dictionaries/JSONs
 
+    # Same settings starlette's JSONResponse renders with, so the encode_* functions below produce identical bytes
+    json_encoder = json.JSONEncoder(ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":"))
+
+    def _rows_to_dicts(self, job_list:list[list]) -> list[dict]:
+        # job_list is header first (include_headers=True). The header row is the precomputed column layout every row is zipped onto
+        if len(job_list) >= 1:
+            headers = tuple(job_list[0])
+            return [dict(zip(headers, row)) for row in job_list[1:]]
+        return []
+
     def generate_jobs_response(self, job_list:list[list]) -> str:
         # This function will receive the database results and convert rows to dicts with columns as keys
-        response = {"jobs" : []}
-        if len(job_list) >= 1:
-            headers = job_list[0]
-            for row in job_list[1:]:
-                row_dict = {}
-                for idx in range(len(row)):
-                    row_dict[headers[idx]] = row[idx]
-                response["jobs"].append(row_dict)
-
-        return response
-    
+        return {"jobs" : self._rows_to_dicts(job_list)}
+
+    def encode_jobs_response(self, job_list:list[list], **extra_fields) -> bytes:
+        # Fast path for the endpoints - encodes straight to JSON bytes with the C encoder and skips FastAPI's jsonable_encoder pass.
+        # Output is byte for byte what returning generate_jobs_response() from an endpoint produces
+        with SERIALIZATION_SECONDS.time(format="json"):
+            response = {"jobs" : self._rows_to_dicts(job_list)}
+            response.update(extra_fields)
+            return self.json_encoder.encode(response).encode("utf-8")
+
+    def encode_jobs_page_response(self, job_list:list[list], limit:int) -> bytes:
+        # Same as encode_jobs_response() plus the cursor for the next page (None once the last page is reached)
+        rows_returned = len(job_list) - 1
+        next_after_job_id = job_list[-1][job_list[0].index("job_id")] if rows_returned > 0 and rows_returned == limit else None
+        return self.encode_jobs_response(job_list, next_after_job_id=next_after_job_id)
+
+    def generate_jobs_ndjson(self, job_list:list[list]) -> str:
+        # One JSON object per line, used when streaming jobs back chunk by chunk
+        encode = self.json_encoder.encode
+        with SERIALIZATION_SECONDS.time(format="ndjson"):
+            return "".join(encode(row_dict) + "\n" for row_dict in self._rows_to_dicts(job_list))
+
+    def encode_jobs_lookup_response(self, job_list:list[list], job_ids:list[int]) -> bytes:
+        # Jobs come back in the order they were requested (duplicates collapsed), ids with no row are listed under "missing"
+        with SERIALIZATION_SECONDS.time(format="json"):
+            jobs_by_id = {row_dict["job_id"]: row_dict for row_dict in self._rows_to_dicts(job_list)}
+            response = {"jobs": [], "missing": []}
+            for job_id in dict.fromkeys(job_ids):
+                if job_id in jobs_by_id:
+                    response["jobs"].append(jobs_by_id[job_id])
+                else:
+                    response["missing"].append(job_id)
+            return self.json_encoder.encode(response).encode("utf-8")
+
+    def encode_job_changes_response(self, job_list:list[list], since_change_id:int) -> tuple[bytes, int]:
+        # Returns the body and the cursor the client should send next time (unchanged when there was nothing new)
+        cursor = job_list[-1][job_list[0].index("change_id")] if len(job_list) > 1 else since_change_id
+        return self.encode_jobs_response(job_list, cursor=cursor), cursor
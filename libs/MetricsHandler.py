@@ -0,0 +1,170 @@
+import threading, time, logging
+from contextlib import contextmanager
+
+
+# Minimal Prometheus style metrics (counters, histograms and gauges read at scrape time) rendered in the text exposition format.
+# Metrics live for the process, with several API workers every worker reports its own values
+
+logger = logging.getLogger(__name__)
+
+# Seconds. Covers sub-millisecond token cache hits up to multi-second full table responses
+DEFAULT_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(label_names:tuple, label_values:tuple, extra:str="") -> str:
+    labels = [f'{name}="{_escape_label_value(value)}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+class Counter:
+
+    def __init__(self, name:str, help_text:str, label_names:tuple=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount:float=1, **labels) -> None:
+        key = tuple(labels.get(name, "") for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in self._values.items():
+                lines.append(f"{self.name}{_format_labels(self.label_names, key)} {value}")
+        return lines
+
+
+class Histogram:
+
+    def __init__(self, name:str, help_text:str, label_names:tuple=(), buckets:tuple=DEFAULT_LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [bucket counts..., sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value:float, **labels) -> None:
+        key = tuple(labels.get(name, "") for name in self.label_names)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0] * (len(self.buckets) + 2)
+            for idx, upper_bound in enumerate(self.buckets):
+                if value <= upper_bound:
+                    series[idx] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in self._values.items():
+                for idx, upper_bound in enumerate(self.buckets):
+                    bucket_label = 'le="' + str(upper_bound) + '"'
+                    lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, bucket_label)} {series[idx]}")
+                inf_label = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, inf_label)} {series[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {series[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {series[-1]}")
+        return lines
+
+
+class Gauge:
+    # Value is read from a callback when /metrics is scraped, i.e. pool/cache stats that already live elsewhere.
+    # The callback returns {label values tuple: value}
+
+    def __init__(self, name:str, help_text:str, label_names:tuple, read_values):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.read_values = read_values
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        try:
+            for key, value in self.read_values().items():
+                lines.append(f"{self.name}{_format_labels(self.label_names, key)} {value}")
+        except Exception as err:
+            logger.error("Unable to read gauge '%s'. '%s'", self.name, err)
+        return lines
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        # Registering the same name twice hands back the existing metric, so modules can declare what they use
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+HTTP_REQUESTS = REGISTRY.register(Counter("api_http_requests_total", "HTTP requests handled", ("method", "route", "status")))
+HTTP_REQUEST_SECONDS = REGISTRY.register(Histogram("api_http_request_duration_seconds", "Time from request received to response sent",
+                                                   ("method", "route")))
+DB_CALL_SECONDS = REGISTRY.register(Histogram("api_db_call_duration_seconds",
+                                              "DBHandler calls made by the endpoints, including the wait for a worker thread", ("call",)))
+DB_QUERY_SECONDS = REGISTRY.register(Histogram("api_db_query_duration_seconds", "Time spent executing a single SQL statement", ("type",)))
+DB_QUERY_ROWS = REGISTRY.register(Histogram("api_db_query_rows", "Rows returned (select) or changed (insert/update/delete) per statement",
+                                            ("type",), buckets=(0, 1, 10, 100, 1000, 10000, 100000, 1000000)))
+DB_SLOW_QUERIES = REGISTRY.register(Counter("api_db_slow_queries_total", "Statements slower than SLOW_QUERY_THRESHOLD_MS", ("type",)))
+SERIALIZATION_SECONDS = REGISTRY.register(Histogram("api_serialization_duration_seconds", "Time spent encoding job rows to JSON", ("format",)))
+
+
+class MetricsMiddleware:
+    # Plain ASGI middleware (no BaseHTTPMiddleware) so streaming responses pass straight through.
+    # Routes are labelled by their template (/job/{job_id}) rather than the raw path to keep the number of series bounded
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            route_path = getattr(route, "path", "unmatched")
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, method=scope["method"], route=route_path)
+            HTTP_REQUESTS.inc(method=scope["method"], route=route_path, status=status["code"])
@@ -0,0 +1,74 @@
+import asyncio, logging
+
+from .DBHandler import DBHandler
+
+
+# Deletes rows the API no longer needs in the background, in short batches:
+# - expired tokens from user_token_journal (already rejected by the token check, this only reclaims the space)
+#   and revocations in user_token_revocations for tokens that have expired anyway
+# - job_status_changes rows older than the change feed's retention period, so the journal stops growing
+
+logger = logging.getLogger(__name__)
+
+class RetentionSweeper:
+
+    def __init__(self, db, interval_seconds:float=300, batch_size:int=1000, job_changes_retention_seconds:float=0):
+        # db is the app's AsyncDBHandler. A job_changes_retention_seconds of 0 keeps every change
+        self.db = db
+        self.interval_seconds = interval_seconds
+        self.batch_size = batch_size
+        self.job_changes_retention_seconds = job_changes_retention_seconds
+        self._task = None
+
+    def start(self) -> None:
+        # An interval of 0 turns the sweeper off
+        if self.interval_seconds > 0:
+            self._task = asyncio.create_task(self._sweep_forever())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _delete_in_batches(self, delete_func, *args) -> int:
+        # One short write transaction per batch. Requests get a turn between batches instead of waiting
+        # behind one long DELETE
+        deleted_total = 0
+        while True:
+            deleted = await self.db.run(delete_func, *args, self.batch_size)
+            deleted_total += deleted
+            if deleted < self.batch_size:
+                return deleted_total
+            await asyncio.sleep(0)
+
+    async def sweep_tokens(self) -> int:
+        deleted_total = await self._delete_in_batches(DBHandler.delete_expired_tokens)
+        # Revocations are only needed until the revoked token would have expired anyway
+        await self._delete_in_batches(DBHandler.delete_expired_token_revocations)
+        return deleted_total
+
+    async def sweep_job_changes(self) -> int:
+        if self.job_changes_retention_seconds <= 0:
+            return 0
+        return await self._delete_in_batches(DBHandler.delete_old_job_changes, self.job_changes_retention_seconds)
+
+    async def _sweep_forever(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            # Each sweep is attempted on its own, a failing one doesn't hold the other back
+            try:
+                deleted_total = await self.sweep_tokens()
+                if deleted_total:
+                    logger.info("Deleted %d expired tokens", deleted_total)
+            except Exception as err:
+                logger.error("Expired token sweep failed. '%s'", err)
+            try:
+                deleted_total = await self.sweep_job_changes()
+                if deleted_total:
+                    logger.info("Deleted %d job changes older than %g days", deleted_total, self.job_changes_retention_seconds / 86400)
+            except Exception as err:
+                logger.error("Job change sweep failed. '%s'", err)
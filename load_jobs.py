@@ -0,0 +1,55 @@
+import argparse, json, os, logging, sys
+
+from libs.DBHandler import DBHandler
+from libs.JobLoader import load_jobs, read_jobs_ndjson, read_jobs_csv
+
+
+# Bulk loads job statuses from a JSONL or CSV file into job_status, same rules as POST /jobs/ingest:
+# jobs are upserted on program in batched transactions and every rejected line is reported with the reason
+#
+#   python load_jobs.py -c config/app-config-dev.json -f jobs.csv
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Bulk load job statuses from a JSONL/CSV file")
+    parser.add_argument("-c", "--config", help="Path to the config file", default="config/app-config-dev.json")
+    parser.add_argument("-f", "--file", help="JSONL (one job per line) or CSV (header row) file to load", required=True)
+    parser.add_argument("--format", help="File format. Defaults to the file extension (.csv is CSV, anything else JSONL)",
+                        choices=("jsonl", "csv"), default=None)
+    parser.add_argument("--batch-size", help="Rows per executemany() batch/transaction", type=int, default=1000)
+    parser.add_argument("--errors-file", help="Write the rejected lines (line number and reason) to this JSON file", default="")
+
+    return parser.parse_args()
+
+def get_config(path_cfg_file:str) -> json:
+    if os.path.exists(path_cfg_file):
+        with open(path_cfg_file) as cfg_file_f:
+            return json.load(cfg_file_f)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO,
+                        format="%(asctime)s - %(funcName)s:%(lineno)d - %(levelname)s - %(message)s",
+                        handlers=[logging.StreamHandler(sys.stdout)]
+    )
+    args = get_args()
+    logging.info(f"Arguments: {args}")
+    cfg = get_config(args.config)
+    # As DB HOST is the path to SQL Lite DB, need to create a relative path rather than hardcode the path into config file
+    database_fullpath = os.path.join(os.path.dirname(__file__), cfg["DB_URL"].split("//")[1])
+    file_format = args.format or ("csv" if args.file.lower().endswith(".csv") else "jsonl")
+
+    with DBHandler(cfg["DB_URL"], db_file_path=database_fullpath) as dbh, open(args.file, newline="", encoding="utf-8") as jobs_file_f:
+        job_records = read_jobs_csv(jobs_file_f) if file_format == "csv" else read_jobs_ndjson(jobs_file_f)
+        report = load_jobs(dbh, job_records, args.batch_size)
+
+    for error in report["errors"][:20]:
+        logging.error(f"Line {error['line']}: {error['error']}")
+    if len(report["errors"]) > 20:
+        logging.error(f"... and {len(report['errors']) - 20} more rejected lines")
+    if args.errors_file:
+        with open(args.errors_file, "w") as errors_file_f:
+            json.dump(report["errors"], errors_file_f, indent=2)
+        logging.info(f"Rejected lines written to '{args.errors_file}'")
+    logging.info(f"Received {report['received']}, changed {report['changed']}, unchanged {report['unchanged']}, failed {report['failed']}")
+    sys.exit(1 if report["failed"] else 0)